@@ -1,520 +1,2788 @@
-from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for
-from flask_cors import CORS
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
-from openai import OpenAI
-import os
-from datetime import datetime
-
-# === CONFIG ===
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable missing.")
-client = OpenAI(api_key=api_key)
-
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "supersecretkey")
-CORS(app)
-bcrypt = Bcrypt(app)
-
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///syrixrm.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-# === MODELS ===
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False)
-
-class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    role = db.Column(db.String(10))
-    content = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-
-with app.app_context():
-    db.create_all()
-
-SYSTEM_PROMPT = "You are SyrixRM, an intelligent, elegant and concise AI assistant."
-
-# === LOGIN PAGE (light themed) ===
-LOGIN_PAGE = """
-<!doctype html>
-<html lang="tr">
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>SyrixRM • Giriş</title>
-<link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&display=swap" rel="stylesheet">
-<style>
-:root{
-  --bg:#f6f8fb;
-  --card:#ffffff;
-  --muted:#97a0b5;
-  --accent-start:#5b8cff;
-  --accent-end:#3db7ff;
-  --glass: rgba(255,255,255,0.6);
-}
-*{box-sizing:border-box}
-body{
-  margin:0;min-height:100vh;display:flex;align-items:center;justify-content:center;
-  font-family:'Inter',sans-serif;background:linear-gradient(180deg,var(--bg),#ffffff);
-}
-.container{
-  width:100%;max-width:920px;padding:40px;
-  display:grid;grid-template-columns:1fr 420px;gap:30px;align-items:center;
-}
-.brand {
-  padding:34px;border-radius:18px;background:linear-gradient(180deg,rgba(255,255,255,0.8),#ffffff);
-  box-shadow:0 10px 40px rgba(60,80,120,0.06);border:1px solid rgba(14,30,60,0.04);
-}
-.logo {
-  font-size:48px;font-weight:800; background: linear-gradient(90deg,var(--accent-start), var(--accent-end));
-  -webkit-background-clip:text; -webkit-text-fill-color:transparent;
-}
-.lead {margin-top:14px;color:var(--muted);font-size:15px}
-.formcard {
-  border-radius:18px;padding:28px;background:var(--card);
-  box-shadow:0 12px 40px rgba(20,30,60,0.06);border:1px solid rgba(14,30,60,0.04);
-}
-.input{width:100%;padding:12px 14px;border-radius:12px;border:1px solid rgba(14,30,60,0.06);margin-top:12px;font-size:15px}
-.btn {
-  width:100%;padding:12px;border-radius:12px;border:none;margin-top:14px;
-  background:linear-gradient(90deg,var(--accent-start), var(--accent-end));color:white;font-weight:600;
-  box-shadow:0 8px 20px rgba(61,183,255,0.18);cursor:pointer;font-size:15px;
-}
-.ghost {background:transparent;border:1px solid rgba(14,30,60,0.06);color:var(--muted)}
-.small {font-size:13px;color:var(--muted);margin-top:12px;display:block;text-align:center}
-a {color:var(--accent-start);text-decoration:none;font-weight:600}
-@media(max-width:880px){
-  .container{grid-template-columns:1fr; padding:20px}
-  .brand{order:2}
-}
-</style>
-</head>
-<body>
-  <div class="container">
-    <div class="brand">
-      <div class="logo">SyrixRM</div>
-      <div class="lead">Hassas, zarif ve özlü bir yapay zeka asistan. Hemen giriş yap veya misafir olarak devam et.</div>
-    </div>
-    <div class="formcard">
-      <form method="POST" action="/login">
-        <input class="input" name="email" placeholder="E-posta" required>
-        <input class="input" name="password" type="password" placeholder="Parola" required>
-        <button class="btn" type="submit">Giriş Yap</button>
-      </form>
-      <form method="POST" action="/guest" style="margin-top:8px">
-        <button class="btn ghost" type="submit">Misafir Olarak Devam Et</button>
-      </form>
-      <div class="small">Hesabın yok mu? <a href="/register">Kayıt Ol</a></div>
-    </div>
-  </div>
-</body>
-</html>
-"""
-
-# === REGISTER PAGE (light themed) ===
-REGISTER_PAGE = """
-<!doctype html>
-<html lang="tr">
-<head>
-<meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
-<title>SyrixRM • Kayıt</title>
-<link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&display=swap" rel="stylesheet">
-<style>
-:root{
-  --bg:#f6f8fb;--card:#ffffff;--muted:#97a0b5;--accent-start:#5b8cff;--accent-end:#3db7ff;
-}
-body{margin:0;min-height:100vh;display:flex;align-items:center;justify-content:center;font-family:'Inter',sans-serif;background:linear-gradient(180deg,var(--bg),#ffffff);}
-.card{width:420px;padding:28px;border-radius:16px;background:var(--card);box-shadow:0 12px 40px rgba(20,30,60,0.06);border:1px solid rgba(14,30,60,0.04)}
-h2{margin:0 0 8px 0;font-size:22px;background:linear-gradient(90deg,var(--accent-start), var(--accent-end));-webkit-background-clip:text;-webkit-text-fill-color:transparent;font-weight:800}
-.lead{color:var(--muted);font-size:14px;margin-bottom:18px}
-.input{width:100%;padding:12px 14px;border-radius:12px;border:1px solid rgba(14,30,60,0.06);margin-top:10px;font-size:15px}
-.btn{width:100%;padding:12px;border-radius:12px;border:none;margin-top:14px;background:linear-gradient(90deg,var(--accent-start), var(--accent-end));color:white;font-weight:600;box-shadow:0 8px 20px rgba(61,183,255,0.18);cursor:pointer}
-.small{font-size:13px;color:var(--muted);margin-top:12px;text-align:center}
-a{color:var(--accent-start);text-decoration:none;font-weight:600}
-</style>
-</head>
-<body>
-  <div class="card">
-    <h2>Hesap Oluştur</h2>
-    <div class="lead">SyrixRM ile hemen konuşmaya başla.</div>
-    <form method="POST" action="/register">
-      <input class="input" name="username" placeholder="Kullanıcı adı" required>
-      <input class="input" name="email" placeholder="E-posta" required>
-      <input class="input" name="password" type="password" placeholder="Parola" required>
-      <button class="btn" type="submit">Kayıt Ol</button>
-    </form>
-    <div class="small">Zaten hesabın var mı? <a href="/login">Giriş Yap</a></div>
-  </div>
-</body>
-</html>
-"""
-
-# === CHAT PAGE (light, premium, büyük chat alanı, typing effect) ===
-CHAT_PAGE = """
-<!doctype html>
-<html lang="tr">
-<head>
-<meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
-<title>SyrixRM</title>
-<link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-<style>
-:root{
-  --bg:#f7f9fc;
-  --panel:#ffffff;
-  --muted:#6b7280;
-  --accent-start:#4f46e5; /* deep indigo */
-  --accent-end:#06b6d4;   /* teal */
-  --glass: rgba(255,255,255,0.75);
-}
-*{box-sizing:border-box}
-html,body{height:100%;margin:0;font-family:'Inter',sans-serif;background:linear-gradient(180deg,var(--bg),#ffffff);color:#0f172a}
-.app {
-  min-height:100vh;display:flex;flex-direction:column;
-}
-.nav {
-  display:flex;justify-content:space-between;align-items:center;padding:20px 36px;
-  background:transparent;
-}
-.brand {font-weight:800;font-size:20px;
-  background:linear-gradient(90deg,var(--accent-start),var(--accent-end));-webkit-background-clip:text;-webkit-text-fill-color:transparent;
-}
-.controls {display:flex;gap:12px;align-items:center}
-.control-btn {padding:10px 12px;border-radius:10px;border:none;background:#fff;box-shadow:0 6px 18px rgba(12,24,50,0.06);cursor:pointer;font-weight:600}
-.container {
-  flex:1;display:flex;align-items:center;justify-content:center;padding:28px;
-}
-.panel {
-  width:100%;max-width:1200px;height:80vh;border-radius:18px;
-  background:linear-gradient(180deg,rgba(255,255,255,0.9),var(--panel));
-  box-shadow:0 20px 60px rgba(15,23,42,0.08);display:grid;grid-template-columns:360px 1fr;overflow:hidden;border:1px solid rgba(10,20,40,0.04)
-}
-
-/* LEFT: side (conversations / actions) */
-.side {
-  padding:20px;border-right:1px solid rgba(10,20,40,0.04);background:linear-gradient(180deg,rgba(250,250,253,0.6),transparent);
-}
-.side .newconv {
-  display:flex;gap:10px;margin-bottom:18px;
-}
-.newconv button{flex:1;padding:10px;border-radius:12px;border:none;background:linear-gradient(90deg,var(--accent-start),var(--accent-end));color:white;font-weight:700;cursor:pointer}
-.side .meta {font-size:13px;color:var(--muted);margin-top:6px}
-
-/* RIGHT: chat area */
-.chat {
-  padding:28px;display:flex;flex-direction:column;gap:12px;height:100%;background:transparent;
-}
-.header {
-  display:flex;justify-content:space-between;align-items:center;padding-bottom:12px;border-bottom:1px solid rgba(10,20,40,0.03);
-}
-.h-title {font-weight:700;font-size:18px}
-.h-sub {font-size:13px;color:var(--muted)}
-.messages-wrap {
-  flex:1;overflow:auto;padding:20px 12px;scrollbar-width:thin;
-  display:flex;flex-direction:column;gap:16px;
-  background:
-    radial-gradient(600px 300px at 10% 10%, rgba(99,102,241,0.03), transparent 8%),
-    radial-gradient(600px 300px at 90% 90%, rgba(6,182,212,0.02), transparent 8%);
-  border-radius:12px;margin-top:12px;padding-bottom:30px;
-}
-.message {
-  display:flex;gap:12px;align-items:flex-start;max-width:85%;
-}
-.message.user {margin-left:auto;flex-direction:row-reverse}
-.avatar {
-  width:44px;height:44px;border-radius:10px;display:flex;align-items:center;justify-content:center;font-weight:700;color:white;
-  background:linear-gradient(135deg,var(--accent-start),var(--accent-end));box-shadow:0 6px 18px rgba(12,24,50,0.08);
-}
-.bubble {
-  padding:14px 16px;border-radius:12px;background:linear-gradient(180deg,#ffffff,#fbfdff);box-shadow:0 10px 30px rgba(12,24,50,0.06);font-size:15px;line-height:1.45;border:1px solid rgba(10,20,40,0.04)
-}
-.user .bubble {background:linear-gradient(90deg,#eef2ff,#e0f7ff);border:1px solid rgba(59,130,246,0.12)}
-.meta {font-size:12px;color:var(--muted);margin-top:6px}
-
-/* input area (sticky bottom) */
-.composer {
-  display:flex;gap:12px;padding:18px;border-top:1px solid rgba(10,20,40,0.03);background:linear-gradient(180deg,transparent, rgba(255,255,255,0.6));
-}
-.textarea {
-  flex:1;background:linear-gradient(180deg,#ffffff,#fbfbff);padding:14px;border-radius:12px;border:1px solid rgba(10,20,40,0.04);
-  font-size:15px;resize:none;min-height:54px;max-height:220px;outline:none;box-shadow:0 6px 18px rgba(12,24,50,0.04);
-}
-.send {
-  padding:12px 16px;border-radius:12px;border:none;background:linear-gradient(90deg,var(--accent-start),var(--accent-end));color:white;font-weight:700;cursor:pointer;
-  box-shadow:0 8px 26px rgba(61,183,255,0.14)
-}
-.typing {
-  display:flex;gap:6px;align-items:center;padding:8px 12px;border-radius:12px;background:rgba(15,23,42,0.02);font-size:13px;color:var(--muted);align-self:flex-start;
-}
-.dot {width:8px;height:8px;border-radius:50%;background:var(--muted);opacity:0.6}
-.dot:nth-child(1){animation:jump 1s infinite;}
-.dot:nth-child(2){animation:jump 1s 0.15s infinite;}
-.dot:nth-child(3){animation:jump 1s 0.3s infinite;}
-@keyframes jump{0%{transform:translateY(0)}50%{transform:translateY(-6px)}100%{transform:translateY(0)}}
-
-/* scrollbar */
-.messages-wrap::-webkit-scrollbar{width:10px}
-.messages-wrap::-webkit-scrollbar-thumb{background:linear-gradient(180deg,rgba(100,116,139,0.16),rgba(100,116,139,0.08));border-radius:10px}
-
-/* responsive */
-@media(max-width:980px){
-  .panel{grid-template-columns:1fr}
-  .side{display:none}
-  .container{padding:12px}
-}
-</style>
-</head>
-<body>
-  <div class="app">
-    <div class="nav">
-      <div class="brand">SyrixRM</div>
-      <div class="controls">
-        {% if username %}
-          <div style="font-weight:600;color:#0f172a">👤 {{username}}</div>
-          <a href="/logout" class="control-btn">Çıkış</a>
-        {% else %}
-          <a href="/login" class="control-btn">Giriş</a>
-        {% endif %}
-      </div>
-    </div>
-
-    <div class="container">
-      <div class="panel" role="main" aria-live="polite">
-        <div class="side">
-          <div class="newconv">
-            <button onclick="newConversation()">+ Yeni Konuşma</button>
-          </div>
-          <div class="meta">Son konuşmalar otomatik kaydedilir.</div>
-        </div>
-
-        <div class="chat">
-          <div class="header">
-            <div>
-              <div class="h-title">SyrixRM</div>
-              <div class="h-sub">Zarif. Net. Yardımcı — Ne hakkında konuşmak istersiniz?</div>
-            </div>
-            <div id="typing-indicator" style="display:none" class="typing" aria-hidden="true">
-              <div class="dot"></div><div class="dot"></div><div class="dot"></div>
-              <div style="margin-left:8px;color:var(--muted);font-weight:600">yazıyor...</div>
-            </div>
-          </div>
-
-          <div class="messages-wrap" id="messages"></div>
-
-          <div class="composer">
-            <textarea id="user-input" class="textarea" placeholder="Mesajınızı yazın... (Shift+Enter yeni satır)"></textarea>
-            <button class="send" id="send-btn">Gönder</button>
-          </div>
-        </div>
-      </div>
-    </div>
-  </div>
-
-<script>
-const messagesEl = document.getElementById('messages');
-const inputEl = document.getElementById('user-input');
-const sendBtn = document.getElementById('send-btn');
-const typingIndicator = document.getElementById('typing-indicator');
-
-function formatTime(dt){
-  const d = new Date(dt);
-  return d.toLocaleTimeString([], {hour:'2-digit', minute:'2-digit'});
-}
-
-function appendMessage(text, role, meta=null, raw=false){
-  const wrapper = document.createElement('div');
-  wrapper.className = 'message ' + (role === 'user' ? 'user' : 'ai');
-
-  const avatar = document.createElement('div');
-  avatar.className = 'avatar';
-  avatar.textContent = role === 'user' ? ({{ 'true' if session.get("username") else 'false' }} ? String("{{session.get('username') or 'U'}}").slice(0,2).toUpperCase() : 'U') : 'AI';
-
-  const bubbleWrap = document.createElement('div');
-  bubbleWrap.style.display = 'flex';
-  bubbleWrap.style.flexDirection = 'column';
-
-  const bubble = document.createElement('div');
-  bubble.className = 'bubble';
-  if(raw){
-    bubble.innerHTML = text;
-  } else {
-    bubble.textContent = text;
-  }
-
-  bubbleWrap.appendChild(bubble);
-
-  if(meta){
-    const m = document.createElement('div');
-    m.className = 'meta';
-    m.textContent = meta;
-    bubbleWrap.appendChild(m);
-  }
-
-  wrapper.appendChild(avatar);
-  wrapper.appendChild(bubbleWrap);
-  messagesEl.appendChild(wrapper);
-  wrapper.scrollIntoView({behavior:'smooth', block:'end'});
-  return bubble;
-}
-
-async function loadHistory(){
-  const res = await fetch('/history');
-  const data = await res.json();
-  if(!data || data.length === 0){ 
-    appendMessage("Merhaba! Sana nasıl yardım edebilirim?","ai", null);
-    return;
-  }
-  data.forEach(m => {
-    appendMessage(m.content, m.role, m.timestamp ? formatTime(m.timestamp) : null);
-  });
-}
-function newConversation(){
-  // basitçe temizle — sunucu tarafında yeni ID vs gerekirse ileride ekle
-  messagesEl.innerHTML = '';
-  appendMessage("Yeni konuşma başlatıldı. Nasıl yardımcı olabilirim?","ai");
-}
-
-function showTyping(on=true){
-  typingIndicator.style.display = on ? 'flex' : 'none';
-}
-
-// typing effect: reveal characters gradually
-function revealText(bubbleElem, text, speed=18){
-  let i = 0;
-  bubbleElem.textContent = '';
-  return new Promise(resolve=>{
-    const iv = setInterval(()=>{
-      bubbleElem.textContent += text[i] === '\\n' ? '\\n' : text[i];
-      i++;
-      if(i >= text.length){
-        clearInterval(iv);
-        resolve();
-      }
-    }, speed);
-  });
-}
-
-async function sendMessage(){
-  const text = inputEl.value.trim();
-  if(!text) return;
-  // append user immediately
-  appendMessage(text, 'user', formatTime(new Date()));
-  inputEl.value = '';
-  // show typing
-  showTyping(true);
-  // send to server
-  try{
-    const res = await fetch('/chat',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:text})});
-    if(!res.ok) throw new Error('Sunucu hatası');
-    const data = await res.json();
-    showTyping(false);
-
-    // append empty bubble and reveal
-    const bubble = appendMessage('', 'ai', formatTime(new Date()));
-    await revealText(bubble, data.reply, 12); // karakter hızı (ms)
-  } catch(err){
-    showTyping(false);
-    appendMessage('Üzgünüm, bir hata oluştu: ' + String(err),'ai');
-  }
-}
-
-sendBtn.addEventListener('click', sendMessage);
-inputEl.addEventListener('keydown', (e)=>{
-  if(e.key === 'Enter' && !e.shiftKey){
-    e.preventDefault();
-    sendMessage();
-  }
-});
-
-// Auto-resize textarea
-inputEl.addEventListener('input', (e)=>{
-  inputEl.style.height = 'auto';
-  inputEl.style.height = (inputEl.scrollHeight) + 'px';
-});
-
-window.addEventListener('load', ()=>{
-  loadHistory();
-});
-</script>
-</body>
-</html>
-"""
-
-# === ROUTES ===
-@app.route("/")
-def root():
-    return render_template_string(CHAT_PAGE, username=session.get("username"))
-
-@app.route("/guest", methods=["POST"])
-def guest():
-    session.clear()
-    # guest için username gösterilmesini istersen session["username"]="Guest" ekle
-    return redirect(url_for('root'))
-
-@app.route("/register", methods=["GET", "POST"])
-def register():
-    if request.method == "POST":
-        username = request.form["username"]
-        email = request.form["email"]
-        password = bcrypt.generate_password_hash(request.form["password"]).decode("utf-8")
-        if User.query.filter((User.username == username) | (User.email == email)).first():
-            return "Username or Email already taken."
-        user = User(username=username, email=email, password=password)
-        db.session.add(user)
-        db.session.commit()
-        return redirect(url_for('login'))
-    return REGISTER_PAGE
-
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    if request.method == "POST":
-        email = request.form["email"]
-        password = request.form["password"]
-        user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
-            session["user_id"] = user.id
-            session["username"] = user.username
-            return redirect(url_for('root'))
-        return "Invalid credentials."
-    return LOGIN_PAGE
-
-@app.route("/logout")
-def logout():
-    session.clear()
-    return redirect(url_for('login'))
-
-@app.route("/chat", methods=["POST"])
-def chat():
-    user_id = session.get("user_id")
-    msg = request.json.get("message", "")
-    history = [{"role": "system", "content": SYSTEM_PROMPT}]
-    if user_id:
-        messages = Message.query.filter_by(user_id=user_id).order_by(Message.id.desc()).limit(12).all()
-        for m in reversed(messages):
-            history.append({"role": m.role, "content": m.content})
-    history.append({"role": "user", "content": msg})
-    # OpenAI çağrısı
-    response = client.chat.completions.create(model="gpt-4o-mini", messages=history)
-    reply = response.choices[0].message.content
-    if user_id:
-        db.session.add(Message(user_id=user_id, role="user", content=msg))
-        db.session.add(Message(user_id=user_id, role="assistant", content=reply))
-        db.session.commit()
-    return jsonify({"reply": reply})
-
-@app.route("/history")
-def history():
-    user_id = session.get("user_id")
-    if not user_id:
-        return jsonify([])
-    messages = Message.query.filter_by(user_id=user_id).order_by(Message.id).all()
-    # timestamp ISO string for client formatting
-    return jsonify([{"role": m.role, "content": m.content, "timestamp": m.timestamp.isoformat()} for m in messages])
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g, has_request_context
+from flask.cli import with_appcontext
+from flask.sessions import SessionInterface, SessionMixin
+from flask_cors import CORS
+from flask_bcrypt import Bcrypt
+from flask_sqlalchemy import SQLAlchemy
+import openai
+from openai import OpenAI
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.datastructures import CallbackDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os
+import json
+import random
+import math
+import click
+import logging
+import gzip
+import io
+import zlib
+import html
+import time
+import queue
+import mimetypes
+import atexit
+import sqlite3
+import tempfile
+import hashlib
+import importlib
+import fcntl
+import re
+import secrets
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# === FAKE LLM (offline test/benchmark mode) ===
+class FakeCompletionClient:
+    """Local stand-in for OpenAI(); echoes the last message so nothing leaves the box."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        text = "echo: " + (messages[-1]["content"] or "")
+        if kwargs.get("max_tokens"):
+            text = " ".join(text.split()[:kwargs["max_tokens"]])
+        if stream:
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+                         for word in text.split()])
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=count_tokens(text),
+                                total_tokens=prompt_tokens + count_tokens(text))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+class AsyncFakeCompletionClient:
+    """AsyncOpenAI-shaped wrapper around FakeCompletionClient for the ASGI chat path."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        result = self.fake.create(model=model, messages=messages, stream=stream, **kwargs)
+        if not stream:
+            return result
+
+        async def chunks():
+            for chunk in result:
+                yield chunk
+        return chunks()
+
+# === CONFIG ===
+# importing this module does no I/O: `app` is built on first access (see APP FACTORY), the
+# upstream clients and the tokenizer on first use, and the schema by `flask --app app migrate`,
+# so gunicorn --preload can fork workers from an already warm parent
+log = logging.getLogger(__name__)
+
+db = SQLAlchemy()
+bcrypt = Bcrypt()
+bp = Blueprint("syrixrm", __name__)
+
+def database_uri():
+    uri = os.getenv("DATABASE_URL", "sqlite:///syrixrm.db")
+    # Heroku-style URLs; SQLAlchemy only accepts the postgresql:// scheme
+    if uri.startswith("postgres://"):
+        uri = "postgresql://" + uri[len("postgres://"):]
+    return uri
+
+def engine_options(uri):
+    """Connection-pool settings; every gunicorn worker holds its own pool of up to size + overflow connections."""
+    options = {}
+    if not uri.startswith("sqlite"):
+        # a server database closes idle connections behind the pool's back
+        options.update(pool_pre_ping=True, pool_recycle=1800)
+    for name, variable, cast in (("pool_size", "SYRIXRM_DB_POOL_SIZE", int),
+                                 ("max_overflow", "SYRIXRM_DB_MAX_OVERFLOW", int),
+                                 ("pool_timeout", "SYRIXRM_DB_POOL_TIMEOUT", float),
+                                 ("pool_recycle", "SYRIXRM_DB_POOL_RECYCLE", int)):
+        if os.getenv(variable):
+            options[name] = cast(os.getenv(variable))
+    if os.getenv("SYRIXRM_DB_PRE_PING"):
+        options["pool_pre_ping"] = os.getenv("SYRIXRM_DB_PRE_PING") != "0"
+    return options
+
+def default_config():
+    uri = database_uri()
+    return {
+        "SECRET_KEY": os.getenv("FLASK_SECRET_KEY", "supersecretkey"),
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "SQLALCHEMY_ENGINE_OPTIONS": engine_options(uri),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "BCRYPT_LOG_ROUNDS": int(os.getenv("SYRIXRM_BCRYPT_ROUNDS", "12")),
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY"),
+        "SYRIXRM_FAKE_LLM": os.getenv("SYRIXRM_FAKE_LLM", "0") != "0",
+        # write-behind Message inserts: SYRIXRM_WRITE_BEHIND=0 commits inline instead
+        "SYRIXRM_WRITE_BEHIND": os.getenv("SYRIXRM_WRITE_BEHIND", "1") != "0",
+        # semantic memory (needs numpy); vectors live under SYRIXRM_MEMORY_DIR, default <instance>/memory
+        "SYRIXRM_MEMORY": os.getenv("SYRIXRM_MEMORY", "0") != "0",
+        "SYRIXRM_MEMORY_DIR": os.getenv("SYRIXRM_MEMORY_DIR"),
+        # "openai", "hash" or "package.module:factory"; defaults to "hash" with SYRIXRM_FAKE_LLM
+        "SYRIXRM_EMBEDDER": os.getenv("SYRIXRM_EMBEDDER"),
+        # keep session data in the shared state instead of the signed cookie
+        "SYRIXRM_SERVER_SESSIONS": os.getenv("SYRIXRM_SERVER_SESSIONS", "0") != "0",
+        # proxies in front of the app whose X-Forwarded-For/-Proto entries are trusted; Heroku's
+        # router is one (DYNO is set there). Guest buckets and the login limiter key on the result
+        "SYRIXRM_PROXY_HOPS": int(os.getenv("SYRIXRM_PROXY_HOPS", "1" if os.getenv("DYNO") else "0")),
+        # the per-app objects below are built from these; the env defaults are parsed with their sections
+        "SYRIXRM_STATE_URL": STATE_URL,
+        "SYRIXRM_CACHE_URL": CACHE_URL,
+        "SYRIXRM_CACHE_SIZE": CACHE_SIZE,
+        "SYRIXRM_CACHE_TTL": CACHE_TTL,
+        "SYRIXRM_ADMISSION_URL": ADMISSION_URL,
+        "SYRIXRM_GUEST_RPM": GUEST_RPM,
+        "SYRIXRM_GUEST_TPM": GUEST_TPM,
+        "SYRIXRM_USER_RPM": USER_RPM,
+        "SYRIXRM_USER_TPM": USER_TPM,
+        "SYRIXRM_PASSWORD_WORKERS": PASSWORD_WORKERS,
+        "SYRIXRM_PASSWORD_QUEUE": PASSWORD_QUEUE,
+        "SYRIXRM_LOGIN_IP_LIMIT": LOGIN_IP_LIMIT,
+        "SYRIXRM_LOGIN_IP_WINDOW": LOGIN_IP_WINDOW,
+        "SYRIXRM_LOGIN_EMAIL_LIMIT": LOGIN_EMAIL_LIMIT,
+        "SYRIXRM_LOGIN_EMAIL_WINDOW": LOGIN_EMAIL_WINDOW,
+        "SYRIXRM_GUEST_CONTEXT_BYTES": GUEST_CONTEXT_BYTES_LIMIT,
+        "SYRIXRM_GUEST_CONTEXT_TURNS": GUEST_CONTEXT_TURNS,
+        "SYRIXRM_GUEST_CONTEXT_GUEST_BYTES": GUEST_CONTEXT_GUEST_BYTES,
+        "SYRIXRM_GUEST_CONTEXT_TTL": GUEST_CONTEXT_TTL,
+        "SYRIXRM_UPSTREAM_TIMEOUT": UPSTREAM_TIMEOUT,
+        "SYRIXRM_UPSTREAM_ATTEMPT_TIMEOUT": UPSTREAM_ATTEMPT_TIMEOUT,
+        "SYRIXRM_UPSTREAM_RETRIES": UPSTREAM_RETRIES,
+        "SYRIXRM_UPSTREAM_THREADS": UPSTREAM_THREADS,
+        "SYRIXRM_HEDGE": HEDGE_ENABLED,
+        "SYRIXRM_FALLBACK_MODEL": FALLBACK_MODEL,
+        "SYRIXRM_FALLBACK_BASE_URL": FALLBACK_BASE_URL,
+        "SYRIXRM_FALLBACK_API_KEY": FALLBACK_API_KEY,
+    }
+
+def services():
+    """The objects create_app() built for the current app: state, caches, limiters, router, writer..."""
+    return current_app.extensions["syrixrm"]
+
+# === UPSTREAM CLIENT ===
+class UpstreamClients:
+    """One app's upstream clients, one per endpoint, created on first use and rebuilt after a fork."""
+
+    def __init__(self, api_key, fake=False):
+        self.api_key = api_key
+        self.fake = fake
+        self._clients = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, base_url=None, api_key=None):
+        # a pooled HTTP connection must never be shared between a --preload parent and its workers
+        client = self._clients.get(base_url) if self._pid == os.getpid() else None
+        if client is None:
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._clients.clear()
+                    self._pid = os.getpid()
+                client = self._clients.get(base_url)
+                if client is None:
+                    api_key = api_key or self.api_key
+                    if self.fake:
+                        client = FakeCompletionClient()
+                    elif not api_key:
+                        raise ValueError("OPENAI_API_KEY environment variable missing.")
+                    else:
+                        # retries, deadlines and hedging are the router's job, see UPSTREAM ROUTING
+                        client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+                    self._clients[base_url] = client
+        return client
+
+def llm_client(base_url=None, api_key=None):
+    """The current app's client for an endpoint (None: the default one)."""
+    return services().clients.get(base_url, api_key)
+
+SQLITE_SYNCHRONOUS = os.getenv("SYRIXRM_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SYRIXRM_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+@event.listens_for(Engine, "connect")
+def configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the writer; NORMAL is durable across app crashes in WAL mode
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+# === METRICS ===
+# under gunicorn set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates every worker (see gunicorn.conf.py)
+SLOW_REQUEST_MS = float(os.getenv("SYRIXRM_SLOW_REQUEST_MS", "0"))
+
+REQUEST_LATENCY = Histogram("syrixrm_request_duration_seconds", "HTTP request latency", ["route", "method", "status"])
+UPSTREAM_LATENCY = Histogram("syrixrm_upstream_duration_seconds", "OpenAI call duration", ["kind", "outcome"],
+                             buckets=(.1, .25, .5, 1, 2, 4, 8, 16, 32, 64))
+UPSTREAM_TTFT = Histogram("syrixrm_upstream_ttft_seconds", "Time to first streamed token",
+                          buckets=(.05, .1, .2, .4, .8, 1.6, 3.2, 6.4))
+UPSTREAM_TOKENS = Counter("syrixrm_upstream_tokens_total", "Tokens reported by response.usage", ["kind", "type"])
+DB_QUERIES = Histogram("syrixrm_db_queries_per_request", "SQL statements per request", ["route"],
+                       buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+DB_TIME = Histogram("syrixrm_db_duration_seconds", "Time spent in SQL per request", ["route"],
+                    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+CACHE_LOOKUPS = Counter("syrixrm_completion_cache_total", "Completion cache lookups", ["result"])
+UPSTREAM_ATTEMPTS = Counter("syrixrm_upstream_attempts_total", "Upstream attempts per route", ["route", "outcome"])
+UPSTREAM_HEDGES = Counter("syrixrm_upstream_hedges_total", "Hedged duplicate requests", ["result"])
+DEDUPLICATED = Counter("syrixrm_upstream_deduplicated_total", "Requests that shared another request's upstream call")
+GUEST_CONTEXT_GUESTS = Gauge("syrixrm_guest_context_guests", "Guest conversations held in memory",
+                             multiprocess_mode="livesum")
+GUEST_CONTEXT_BYTES = Gauge("syrixrm_guest_context_bytes", "Approximate bytes held by the guest context store",
+                            multiprocess_mode="livesum")
+GUEST_CONTEXT_EVICTIONS = Counter("syrixrm_guest_context_evictions_total", "Guest context evictions", ["reason"])
+ADMISSION_REJECTED = Counter("syrixrm_admission_rejected_total", "Requests turned away by a token bucket",
+                             ["tier", "bucket"])
+
+def add_stage(name, seconds):
+    if has_request_context() and "metrics" in g:
+        stages = g.metrics["stages"]
+        stages[name] = stages.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - started)
+
+def record_usage(kind, usage):
+    if usage is not None:
+        UPSTREAM_TOKENS.labels(kind, "prompt").inc(usage.prompt_tokens or 0)
+        UPSTREAM_TOKENS.labels(kind, "completion").inc(usage.completion_tokens or 0)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    if has_request_context() and "metrics" in g:
+        g.metrics["db_queries"] += 1
+        add_stage("db", elapsed)
+
+@bp.before_app_request
+def start_request_timer():
+    g.metrics = {"started": time.perf_counter(), "stages": {}, "db_queries": 0}
+
+@bp.after_app_request
+def record_request(response):
+    metrics = g.metrics
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    method = request.method
+
+    # streamed bodies finish after this hook, so observe when the response is closed
+    def finish():
+        elapsed = time.perf_counter() - metrics["started"]
+        REQUEST_LATENCY.labels(route, method, str(response.status_code)).observe(elapsed)
+        DB_QUERIES.labels(route).observe(metrics["db_queries"])
+        DB_TIME.labels(route).observe(metrics["stages"].get("db", 0.0))
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            breakdown = " ".join(f"{k}={v * 1000:.1f}ms" for k, v in sorted(metrics["stages"].items()))
+            log.warning("slow request %s %s %d %.1fms queries=%d %s", method, route,
+                               response.status_code, elapsed * 1000, metrics["db_queries"], breakdown)
+    response.call_on_close(finish)
+    return response
+
+@bp.route("/metrics")
+def metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+# === MODELS ===
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(50), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(200), nullable=False)
+
+class Message(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    role = db.Column(db.String(10))
+    content = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    tokens = db.Column(db.Integer)  # counted at write time, NULL for legacy rows
+
+    # serves both the keyset-paged /history and the recent-window lookup in build_context()
+    __table_args__ = (db.Index("ix_message_user_id_id", "user_id", "id"),)
+
+class ConversationSummary(db.Model):
+    # rolling summary of every message up to last_message_id that fell out of the context window
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MessageArchive(db.Model):
+    # a compressed run of one user's oldest messages, moved out of the hot table by `flask compact`;
+    # message ids are kept so /history cursors work across the boundary
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    codec = db.Column(db.String(8), nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (db.Index("ix_message_archive_user_id_last_id", "user_id", "last_id"),)
+
+def upgrade_schema():
+    """Bring the schema up to date; idempotent, so it is safe to run on every deploy."""
+    db.create_all()
+    # create_all skips existing tables, so add new columns and indexes to old databases too
+    columns = {c["name"] for c in db.inspect(db.engine).get_columns("message")}
+    if "tokens" not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE message ADD COLUMN tokens INTEGER"))
+    for index in Message.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    return upgrade_search_index()
+
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    """Create missing tables, columns and indexes."""
+    if upgrade_schema():
+        click.echo("Search index created; run `flask --app app search-backfill` to index existing messages.")
+    click.echo("Schema is up to date.")
+
+# === SEARCH ===
+# FTS5 index over Message.content kept in sync by triggers, so write-behind batches
+# and inline commits are covered alike. user_id is indexed as well: filtering on it
+# inside MATCH intersects posting lists instead of ranking every user's hits.
+# The index keeps its own copy of each message (role and timestamp unindexed), so rows
+# `flask compact` moves into MessageArchive blocks stay searchable, snippets included.
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_BACKFILL_BATCH = int(os.getenv("SYRIXRM_SEARCH_BACKFILL_BATCH", "5000"))
+SEARCH_SNIPPET_TOKENS = 16
+
+# the index's own columns; rowid is the message id
+SEARCH_COLUMNS = "rowid, content, user_id, role, timestamp"
+SEARCH_TABLES = f"""
+CREATE VIRTUAL TABLE message_fts USING fts5(
+    content, user_id, role UNINDEXED, timestamp UNINDEXED, tokenize='unicode61 remove_diacritics 2');
+-- rank by text relevance only; user_id is just a filter
+INSERT INTO message_fts(message_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0, 0.0, 0.0)');
+-- messages with ids in [next_id, until_id] and archive blocks from next_block on predate the index
+CREATE TABLE message_fts_backfill (next_id INTEGER NOT NULL, until_id INTEGER NOT NULL, next_block INTEGER NOT NULL);
+INSERT INTO message_fts_backfill SELECT 1, COALESCE(MAX(id), 0), 1 FROM message;
+CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+    INSERT INTO message_fts({SEARCH_COLUMNS}) VALUES (new.id, new.content, new.user_id, new.role, new.timestamp);
+END;
+-- compaction deletes rows it has just copied into an archive block; those keep their entries
+CREATE TRIGGER message_fts_delete AFTER DELETE ON message WHEN NOT EXISTS (
+    SELECT 1 FROM message_archive WHERE user_id = old.user_id AND last_id >= old.id AND first_id <= old.id) BEGIN
+    DELETE FROM message_fts WHERE rowid = old.id;
+END;
+-- backfill uses INSERT OR REPLACE, so re-indexing a row here before it gets there is harmless
+CREATE TRIGGER message_fts_update AFTER UPDATE ON message BEGIN
+    DELETE FROM message_fts WHERE rowid = old.id;
+    INSERT INTO message_fts({SEARCH_COLUMNS}) VALUES (new.id, new.content, new.user_id, new.role, new.timestamp);
+END;
+"""
+# the first version indexed message externally (content='message'), which loses archived rows
+SEARCH_OLD_SCHEMA = """
+DROP TRIGGER IF EXISTS message_fts_insert;
+DROP TRIGGER IF EXISTS message_fts_delete;
+DROP TRIGGER IF EXISTS message_fts_update;
+DROP TABLE IF EXISTS message_fts;
+DROP TABLE IF EXISTS message_fts_backfill;
+"""
+
+SEARCH_SQL = f"""
+SELECT rowid AS id, role, timestamp,
+       snippet(message_fts, 0, char(2), char(3), '…', {SEARCH_SNIPPET_TOKENS}) AS snippet
+FROM message_fts
+WHERE message_fts MATCH :match
+ORDER BY rank
+LIMIT :limit OFFSET :offset
+"""
+
+def search_index_exists(conn):
+    return conn.execute(db.text("SELECT 1 FROM sqlite_master WHERE name = 'message_fts'")).first() is not None
+
+def upgrade_search_index():
+    """Create the FTS table and its triggers; returns True when older messages need a backfill."""
+    if db.engine.dialect.name != "sqlite":
+        log.warning("full-text search needs SQLite FTS5; /search is disabled on %s", db.engine.dialect.name)
+        return False
+    with db.engine.connect() as conn:
+        old = conn.execute(db.text("SELECT sql FROM sqlite_master WHERE name = 'message_fts'")).scalar()
+    if old is not None and "content='message'" not in old:
+        return False
+    if old is not None:
+        log.warning("rebuilding the search index so archived messages stay searchable; run search-backfill")
+    # one explicit transaction so no message slips between the trigger and the backfill mark
+    raw = db.engine.raw_connection()
+    try:
+        raw.executescript("BEGIN IMMEDIATE;" + SEARCH_OLD_SCHEMA + SEARCH_TABLES + "COMMIT;")
+    except sqlite3.OperationalError as e:
+        raw.rollback()
+        log.warning("full-text search unavailable: %s", e)
+        return False
+    finally:
+        raw.close()
+    with db.engine.connect() as conn:
+        return (conn.execute(db.text("SELECT until_id FROM message_fts_backfill")).scalar() > 0
+                or conn.execute(db.select(MessageArchive.id).limit(1)).first() is not None)
+
+def backfill_search_index(batch_size=SEARCH_BACKFILL_BATCH):
+    """Index messages and archive blocks written before the FTS table existed, one short transaction per batch.
+
+    Progress is stored in message_fts_backfill, so an interrupted run resumes where it stopped.
+    """
+    indexed = 0
+    while True:
+        with db.engine.begin() as conn:
+            state = conn.execute(db.text("SELECT next_id, until_id FROM message_fts_backfill")).first()
+            if state is None or state.next_id > state.until_id:
+                break
+            stop = min(state.next_id + batch_size, state.until_id + 1)
+            result = conn.execute(db.text(
+                f"INSERT OR REPLACE INTO message_fts({SEARCH_COLUMNS}) "
+                "SELECT id, content, user_id, role, timestamp FROM message WHERE id >= :start AND id < :stop"),
+                {"start": state.next_id, "stop": stop})
+            conn.execute(db.text("UPDATE message_fts_backfill SET next_id = :stop"), {"stop": stop})
+        indexed += result.rowcount
+    # blocks archived since the index existed were indexed while hot; re-adding them is harmless
+    while True:
+        with db.engine.begin() as conn:
+            next_block = conn.execute(db.text("SELECT next_block FROM message_fts_backfill")).scalar()
+            blocks = conn.execute(db.select(MessageArchive).where(MessageArchive.id >= next_block)
+                                  .order_by(MessageArchive.id).limit(max(1, batch_size // ARCHIVE_BLOCK_SIZE))).all()
+            if not blocks:
+                return indexed
+            rows = [{"id": row[0], "content": row[2], "user_id": block.user_id, "role": row[1],
+                     # archived timestamps are ISO text; the index holds them as SQLite stores DateTime
+                     "timestamp": row[3].replace("T", " ") if row[3] else None}
+                    for block in blocks for row in archived_rows(block)]
+            conn.execute(db.text(f"INSERT OR REPLACE INTO message_fts({SEARCH_COLUMNS}) "
+                                 "VALUES (:id, :content, :user_id, :role, :timestamp)"), rows)
+            conn.execute(db.text("UPDATE message_fts_backfill SET next_block = :next"), {"next": blocks[-1].id + 1})
+        indexed += len(rows)
+
+@click.command("search-backfill")
+@click.option("--batch-size", default=SEARCH_BACKFILL_BATCH, show_default=True)
+@with_appcontext
+def search_backfill_command(batch_size):
+    """Index messages that predate the search index."""
+    click.echo(f"Indexed {backfill_search_index(batch_size)} messages.")
+
+def match_expression(user_id, text):
+    # every term is quoted so user input can't inject FTS5 syntax; a trailing * keeps prefix search
+    terms = []
+    for term in text.split():
+        prefix = term.endswith("*") and len(term) > 1
+        term = term.rstrip("*")
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        return None
+    # the terms are scoped to content, otherwise a search for "7" matches user 7's user_id column
+    return f'user_id : "{int(user_id)}" AND content : ({" ".join(terms)})'
+
+def highlight(snippet):
+    return html.escape(snippet or "").replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+def search_messages(user_id, text, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Ranked hits for text among user_id's messages, plus one extra row to tell if more exist."""
+    match = match_expression(user_id, text)
+    if match is None:
+        return []
+    query = db.text(SEARCH_SQL).columns(id=db.Integer, role=db.String, timestamp=db.DateTime, snippet=db.Text)
+    return db.session.execute(query, {"match": match, "limit": limit, "offset": offset}).all()
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+SYSTEM_PROMPT = "You are SyrixRM, an intelligent, elegant and concise AI assistant."
+SUMMARY_PROMPT = ("You maintain a running summary of a conversation between a user and SyrixRM. "
+                  "Merge the new turns into the existing summary. Keep facts, names, preferences "
+                  "and open questions; drop pleasantries. Reply with the updated summary only.")
+MODEL = "gpt-4o-mini"
+
+# prompt budget for summary + recent turns; the new message comes on top of it
+CONTEXT_TOKEN_BUDGET = int(os.getenv("SYRIXRM_CONTEXT_TOKENS", "3000"))
+# upper bound on rows scanned when packing the window
+CONTEXT_MAX_MESSAGES = int(os.getenv("SYRIXRM_CONTEXT_MAX_MESSAGES", "200"))
+# turns are folded into the summary this many tokens at a time; until then they stay in the prompt
+SUMMARY_BATCH_TOKENS = int(os.getenv("SYRIXRM_SUMMARY_BATCH_TOKENS", "800"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SYRIXRM_SUMMARY_MAX_TOKENS", "400"))
+# overhead of the role/separator wrapping around each chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+WRITE_BATCH_SIZE = int(os.getenv("SYRIXRM_WRITE_BATCH_SIZE", "64"))
+WRITE_INTERVAL = float(os.getenv("SYRIXRM_WRITE_INTERVAL", "0.2"))
+# a locked or unreachable database is retried with backoff up to this delay; queued rows are never dropped for it
+WRITE_RETRY_MAX_DELAY = float(os.getenv("SYRIXRM_WRITE_RETRY_MAX_DELAY", "5"))
+# exchanges the writer may hold; beyond that save_exchange commits inline instead of queueing
+WRITE_QUEUE_SIZE = int(os.getenv("SYRIXRM_WRITE_QUEUE_SIZE", "10000"))
+# how long a reader waits for its own queued rows before querying without them
+WRITE_SYNC_TIMEOUT = float(os.getenv("SYRIXRM_WRITE_SYNC_TIMEOUT", "2"))
+
+# guest conversations live only in memory: SYRIXRM_GUEST_CONTEXT_BYTES=0 keeps guests stateless
+GUEST_CONTEXT_BYTES_LIMIT = int(os.getenv("SYRIXRM_GUEST_CONTEXT_BYTES", str(32 * 1024 * 1024)))
+GUEST_CONTEXT_TURNS = int(os.getenv("SYRIXRM_GUEST_CONTEXT_TURNS", "20"))
+# one guest's share of that; a larger turn isn't stored at all, so it can't push other guests out
+GUEST_CONTEXT_GUEST_BYTES = int(os.getenv("SYRIXRM_GUEST_CONTEXT_GUEST_BYTES", str(64 * 1024)))
+GUEST_CONTEXT_TTL = int(os.getenv("SYRIXRM_GUEST_CONTEXT_TTL", "1800"))
+
+# completion cache: SYRIXRM_CACHE_SIZE=0 disables it; it is shared whenever the shared state is,
+# and SYRIXRM_CACHE_URL (same forms as SYRIXRM_STATE_URL) gives it a store of its own
+CACHE_SIZE = int(os.getenv("SYRIXRM_CACHE_SIZE", "1024"))
+CACHE_TTL = int(os.getenv("SYRIXRM_CACHE_TTL", "3600"))
+CACHE_URL = os.getenv("SYRIXRM_CACHE_URL")
+
+# === CONTEXT BUILDER ===
+_encoding = None
+_encoding_loaded = False
+
+def token_encoding():
+    # loaded on first use rather than at import: get_encoding() may download the BPE file
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base") if tiktoken is not None else None
+        except Exception as e:
+            log.warning("tiktoken encoding unavailable, estimating token counts: %s", e)
+        _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # tiktoken yoksa kaba tahmin: ~4 karakter / token
+    return max(1, len(text) // 4)
+
+def message_tokens(m):
+    tokens = m.tokens if m.tokens is not None else count_tokens(m.content)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+def history_tokens(history):
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in history)
+
+def recent_window(user_id, budget, after_id=0):
+    """Newest messages after after_id that fit in budget, oldest first, plus the id where the window starts."""
+    rows = (Message.query.filter(Message.user_id == user_id, Message.id > after_id)
+            .order_by(Message.id.desc()).limit(CONTEXT_MAX_MESSAGES).all())
+    window = []
+    used = 0
+    for m in rows:
+        tokens = message_tokens(m)
+        if used + tokens > budget:
+            break
+        window.append(m)
+        used += tokens
+    window.reverse()
+    if window:
+        start_id = window[0].id
+    elif rows:
+        start_id = rows[0].id + 1
+    else:
+        start_id = None
+    return window, start_id
+
+def summary_budget(summary):
+    """Tokens left for the turns the summary doesn't cover yet; build_context and refresh_summary share it."""
+    budget = CONTEXT_TOKEN_BUDGET - (summary.tokens + MESSAGE_OVERHEAD_TOKENS if summary else 0)
+    if current_app.extensions["syrixrm"].memory is not None:
+        # room kept for recalled messages
+        budget -= MEMORY_TOKEN_BUDGET
+    return budget
+
+def build_context(user_id, msg, guest_id=None):
+    history = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if not user_id and guest_id:
+        history += services().guest_contexts.window(guest_id, CONTEXT_TOKEN_BUDGET)
+    if user_id:
+        sync_messages(user_id)
+        summary = db.session.get(ConversationSummary, user_id)
+        # refresh_summary keeps the unsummarized turns within this budget, so normally all of them fit
+        window, start_id = recent_window(user_id, summary_budget(summary), summary.last_message_id if summary else 0)
+        if summary:
+            history.append({"role": "system", "content": "Summary of the earlier conversation:\n" + summary.content})
+        recalled = recall_memories(user_id, msg, start_id)
+        if recalled:
+            history.append({"role": "system", "content": "Earlier messages that may be relevant:\n"
+                            + "\n".join(f"{role}: {content}" for role, content in recalled)})
+        for m in window:
+            history.append({"role": m.role, "content": m.content})
+    history.append({"role": "user", "content": msg})
+    return history
+
+def refresh_summary(user_id):
+    """Fold the oldest unsummarized turns into the stored summary, one batch at a time.
+
+    Turns outside the newest summary_budget - SUMMARY_BATCH_TOKENS are folded once they add
+    up to a batch, so the unsummarized turns never outgrow summary_budget and build_context
+    can send every one of them.
+    """
+    summary = db.session.get(ConversationSummary, user_id)
+    after_id = summary.last_message_id if summary else 0
+    _, start_id = recent_window(user_id, summary_budget(summary) - SUMMARY_BATCH_TOKENS, after_id)
+    if start_id is None:
+        return
+    pending = (Message.query.filter(Message.user_id == user_id, Message.id > after_id, Message.id < start_id)
+               .order_by(Message.id).limit(CONTEXT_MAX_MESSAGES).all())
+    if sum(message_tokens(m) for m in pending) < SUMMARY_BATCH_TOKENS:
+        return
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in pending)
+    previous = summary.content if summary else "(empty)"
+    prompt = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Current summary:\n{previous}\n\nNew turns:\n{transcript}"},
+    ]
+    started = time.perf_counter()
+    # background work: deadline and retries, but no hedged duplicates
+    response = services().router.complete(prompt, hedge=False, max_tokens=SUMMARY_MAX_TOKENS)
+    UPSTREAM_LATENCY.labels("summary", "ok").observe(time.perf_counter() - started)
+    record_usage("summary", getattr(response, "usage", None))
+    content = response.choices[0].message.content
+    if summary is None:
+        summary = ConversationSummary(user_id=user_id)
+        db.session.add(summary)
+    summary.content = content
+    summary.tokens = count_tokens(content)
+    summary.last_message_id = pending[-1].id
+    db.session.commit()
+
+# === GUEST CONTEXT ===
+class GuestContextStore:
+    """Recent turns of guest conversations, kept in this process's memory and never in SQLite.
+
+    Each turn is a (role, tokens, time, utf-8 bytes) tuple. A guest keeps at most max_turns
+    turns and max_guest_bytes bytes, losing its own oldest turns first; a turn larger than
+    that is not stored. Whole guests are evicted least recently used once the store passes
+    max_bytes, or once they have been idle for idle_ttl seconds.
+    """
+
+    # rough cost of the tuple and the bytes object around each turn's text
+    TURN_OVERHEAD = 120
+
+    def __init__(self, max_bytes, max_turns, idle_ttl, max_guest_bytes=GUEST_CONTEXT_GUEST_BYTES):
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_guest_bytes = min(max_guest_bytes, max_bytes)
+        self.bytes = 0
+        self.evictions = {"capacity": 0, "idle": 0, "turns": 0, "size": 0, "oversize": 0}
+        self._guests = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _size(cls, turn):
+        return len(turn[3]) + cls.TURN_OVERHEAD
+
+    def _evict(self, reason, count=1):
+        self.evictions[reason] += count
+        GUEST_CONTEXT_EVICTIONS.labels(reason).inc(count)
+
+    def _drop(self, guest_id):
+        guest = self._guests.pop(guest_id)
+        self.bytes -= guest.bytes
+        return guest
+
+    def _expire(self, now):
+        # the OrderedDict is in last-use order, so idle guests sit at the front
+        while self._guests:
+            guest_id, guest = next(iter(self._guests.items()))
+            if guest.seen > now - self.idle_ttl:
+                break
+            self._drop(guest_id)
+            self._evict("idle")
+
+    def _publish(self):
+        GUEST_CONTEXT_GUESTS.set(len(self._guests))
+        GUEST_CONTEXT_BYTES.set(self.bytes)
+
+    def add(self, guest_id, turns):
+        if self.max_bytes <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            guest = self._guests.get(guest_id)
+            if guest is None:
+                guest = self._guests[guest_id] = SimpleNamespace(turns=deque(), bytes=0, seen=now)
+            self._guests.move_to_end(guest_id)
+            guest.seen = now
+            for role, content in turns:
+                data = content.encode("utf-8")
+                if len(data) + self.TURN_OVERHEAD > self.max_guest_bytes:
+                    self._evict("oversize")
+                    continue
+                turn = (role, count_tokens(content), now, data)
+                guest.turns.append(turn)
+                guest.bytes += self._size(turn)
+                self.bytes += self._size(turn)
+            # a guest pays for its own growth before anyone else is evicted
+            while guest.turns and (len(guest.turns) > self.max_turns or guest.bytes > self.max_guest_bytes):
+                reason = "turns" if len(guest.turns) > self.max_turns else "size"
+                size = self._size(guest.turns.popleft())
+                guest.bytes -= size
+                self.bytes -= size
+                self._evict(reason)
+            if not guest.turns:
+                self._drop(guest_id)
+            while self.bytes > self.max_bytes and self._guests:
+                self._drop(next(iter(self._guests)))
+                self._evict("capacity")
+            self._publish()
+
+    def window(self, guest_id, budget):
+        """Newest turns that fit in budget tokens, oldest first, as chat messages."""
+        with self._lock:
+            self._expire(time.time())
+            guest = self._guests.get(guest_id)
+            if guest is None:
+                return []
+            self._guests.move_to_end(guest_id)
+            guest.seen = time.time()
+            turns = list(guest.turns)
+        window = []
+        used = 0
+        for role, tokens, _, text in reversed(turns):
+            used += tokens + MESSAGE_OVERHEAD_TOKENS
+            if used > budget:
+                break
+            window.append({"role": role, "content": text.decode("utf-8")})
+        window.reverse()
+        return window
+
+    def pop(self, guest_id):
+        """Remove a guest and return their turns as (role, content, time) tuples."""
+        with self._lock:
+            guest = self._drop(guest_id) if guest_id in self._guests else None
+            self._publish()
+        if guest is None:
+            return []
+        return [(role, text.decode("utf-8"), at) for role, _, at, text in guest.turns]
+
+    def stats(self):
+        return {"guests": len(self._guests), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "evictions": dict(self.evictions)}
+
+def guest_session_id():
+    # random per guest session; /guest and /logout clear it together with the rest of the session
+    if session.get("user_id"):
+        return None
+    return session.setdefault("guest_id", secrets.token_urlsafe(16))
+
+# === WRITE-BEHIND ===
+class MessageWriter:
+    """Batches Message inserts into grouped transactions on a background thread.
+
+    A batch is written once it reaches batch_size rows or interval seconds after its
+    first row, whichever comes first. Readers call sync(user_id) before querying so
+    a user sees their own pending rows, but only those queued in this process: a
+    request that lands on another worker can miss them for up to interval seconds.
+
+    A batch that fails because the database is busy or the connection was lost is
+    retried with backoff until it is written; any other failure (read-only or full
+    database, broken schema, a bad row) is retried row by row and what still fails is
+    dropped, so it can't wedge the writer. add() refuses rows once queue_size
+    exchanges are waiting, and the caller writes them itself.
+    """
+
+    def __init__(self, app, batch_size, interval, queue_size=WRITE_QUEUE_SIZE):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self._queue = queue.Queue(queue_size)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._summaries = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+    def _ensure_thread(self):
+        # (re)started lazily so forked gunicorn workers get their own writer
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+
+    def add(self, rows):
+        """Queue rows for the next batch; False if the queue is full and they weren't taken."""
+        self._ensure_thread()
+        with self._lock:
+            try:
+                self._queue.put_nowait(rows)
+            except queue.Full:
+                return False
+            for row in rows:
+                self._pending[row["user_id"]] = self._pending.get(row["user_id"], 0) + 1
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written; False if timeout ran out first."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        started = time.monotonic()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(None if timeout is None else max(0.0, timeout - (time.monotonic() - started)))
+
+    def sync(self, user_id):
+        if self._pending.get(user_id) and not self.flush(WRITE_SYNC_TIMEOUT):
+            log.warning("message writer is behind; reading user %s without their queued rows", user_id)
+
+    def _run(self):
+        while True:
+            rows, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                rows.extend(item)
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if rows:
+                self._write(rows)
+            for waiter in waiters:
+                waiter.set()
+
+    def _insert(self, rows):
+        delay = 0.05
+        while True:
+            try:
+                db.session.execute(insert(Message), rows)
+                db.session.commit()
+                return
+            except OperationalError as e:
+                if not transient_write_error(e):
+                    raise
+                db.session.rollback()
+                self.retries += 1
+                log.warning("writing %d queued messages failed, retrying in %.2fs: %s", len(rows), delay, e)
+                time.sleep(delay)
+                delay = min(delay * 2, WRITE_RETRY_MAX_DELAY)
+
+    def _write(self, rows):
+        with self.app.app_context():
+            try:
+                self._insert(rows)
+                self.batches += 1
+                self.written += len(rows)
+            except Exception as e:
+                db.session.rollback()
+                log.warning("writing %d queued messages failed, retrying one by one: %s", len(rows), e)
+                for row in rows:
+                    try:
+                        self._insert([row])
+                        self.written += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        self.failed += 1
+                        log.error("dropped queued message for user %s: %s", row["user_id"], e)
+        users = {row["user_id"] for row in rows}
+        with self._lock:
+            for row in rows:
+                left = self._pending.get(row["user_id"], 0) - 1
+                if left > 0:
+                    self._pending[row["user_id"]] = left
+                else:
+                    self._pending.pop(row["user_id"], None)
+        for user_id in users:
+            schedule_memory(self.app, user_id)
+            try:
+                self._summaries.submit(refresh_summary_safely, self.app, user_id)
+            except RuntimeError:
+                # interpreter is shutting down; the next write for this user retries the summary
+                break
+
+# OperationalErrors worth waiting out; everything else (read-only or full disk, missing
+# table, failing trigger) won't fix itself and goes down the row-by-row path instead
+TRANSIENT_WRITE_ERRORS = ("database is locked", "database table is locked", "database is busy",
+                          "could not connect", "connection refused", "server closed the connection",
+                          "terminating connection", "connection reset")
+
+def transient_write_error(e):
+    message = str(getattr(e, "orig", e)).lower()
+    return e.connection_invalidated or any(marker in message for marker in TRANSIENT_WRITE_ERRORS)
+
+def message_writer():
+    return current_app.extensions["syrixrm"].writer
+
+@atexit.register
+def flush_pending_messages():
+    for app in _apps:
+        writer = app.extensions["syrixrm"].writer
+        if writer is not None and not writer.flush(timeout=10):
+            log.error("exiting with queued messages the writer could not store")
+
+def sync_messages(user_id):
+    writer = message_writer()
+    if writer is not None and user_id:
+        writer.sync(user_id)
+
+def refresh_summary_safely(app, user_id):
+    with app.app_context():
+        try:
+            refresh_summary(user_id)
+        except Exception as e:
+            # özet güncellenemezse cevap yine de kaydedildi; bir sonraki turda tekrar denenir
+            db.session.rollback()
+            log.warning("summary refresh failed for user %s: %s", user_id, e)
+
+# === SHARED STATE ===
+# one small key/value + token-bucket interface behind the completion cache, admission buckets,
+# login limiters, cross-process single-flight claims and (optionally) server-side sessions.
+# SYRIXRM_STATE_URL picks the backend:
+#   memory://                 this process only (default; one worker, tests)
+#   shm:// or sqlite:///path  one SQLite file every worker on the node shares; shm:// puts it in /dev/shm
+#   redis://host:6379/0       every worker on every node
+STATE_URL = os.getenv("SYRIXRM_STATE_URL", "memory://")
+STATE_MAX_KEYS = int(os.getenv("SYRIXRM_STATE_MAX_KEYS", "100000"))
+
+def refill(tokens, updated, now, cost, capacity, rate):
+    """Token-bucket step shared by the backends; returns (tokens left, seconds to wait or 0)."""
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+class MemoryState:
+    """Process-local state: an LRU of at most max_keys entries, each with its own TTL."""
+
+    shared = False
+
+    def __init__(self, max_keys=STATE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item[0]
+
+    def _put(self, key, value, expires):
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key, time.monotonic())
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._put(key, value, time.monotonic() + ttl)
+
+    def add(self, key, value, ttl):
+        """Set key only if it is absent; True when this call set it."""
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._put(key, value, now + ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, ttl):
+        """Add one to a counter that expires ttl seconds after its first increment; returns the new count."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] <= now:
+                item = (0, now + ttl)
+            self._put(key, item[0] + 1, item[1])
+            return item[0] + 1
+
+    def take(self, key, cost, capacity, rate):
+        """Spend cost tokens from a bucket if available; returns 0, or the seconds until they will be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._live(key, now) or (capacity, now)
+            tokens, wait = refill(tokens, updated, now, cost, capacity, rate)
+            # a bucket that has had time to refill is the same as a missing one
+            self._put(key, (tokens, now), now + capacity / rate + 1)
+            return wait
+
+    def __len__(self):
+        return len(self._data)
+
+class SQLiteState:
+    """State in one SQLite file shared by every process on the node; put it on tmpfs (/dev/shm)."""
+
+    shared = True
+    SCHEMA = "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB, expires REAL NOT NULL)"
+
+    def __init__(self, path, purge_every=1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        # one connection per thread, opened lazily and never inherited across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # nothing here has to survive a reboot
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(self.SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _wrote(self, conn, now):
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute("DELETE FROM state WHERE expires <= ?", (now,))
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM state WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        conn, now = self._conn(), time.time()
+        conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", (key, value, now + ttl))
+        self._wrote(conn, now)
+
+    def add(self, key, value, ttl):
+        conn, now = self._conn(), time.time()
+        # an expired row counts as absent
+        cursor = conn.execute("INSERT INTO state VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+                              "SET value = excluded.value, expires = excluded.expires WHERE expires <= ?",
+                              (key, value, now + ttl, now))
+        self._wrote(conn, now)
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def incr(self, key, ttl):
+        conn, now = self._conn(), time.time()
+        count = conn.execute("INSERT INTO state VALUES (?, 1, ?) ON CONFLICT(key) DO UPDATE "
+                             "SET value = CASE WHEN expires <= ? THEN 1 ELSE value + 1 END, "
+                             "expires = CASE WHEN expires <= ? THEN excluded.expires ELSE expires END "
+                             "RETURNING value", (key, now + ttl, now, now)).fetchone()[0]
+        self._wrote(conn, now)
+        return count
+
+    def take(self, key, cost, capacity, rate):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT value FROM state WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            tokens, updated = map(float, row[0].split()) if row else (capacity, now)
+            tokens, wait = refill(tokens, updated, now, cost, capacity, rate)
+            conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+                         (key, f"{tokens} {now}", now + capacity / rate + 1))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._wrote(conn, now)
+        return wait
+
+class RedisState:
+    """State in Redis (or anything speaking its protocol), shared by every worker and node; needs the redis package."""
+
+    shared = True
+    # the first line names the script for Redis stand-ins that can't run Lua (see bench/fake_redis.py)
+    TAKE_SCRIPT = """-- syrixrm: token bucket
+    local capacity, rate, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local clock = redis.call("TIME")
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+    redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url, prefix="syrixrm:"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self.TAKE_SCRIPT)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._redis.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self._redis.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    def add(self, key, value, ttl):
+        return bool(self._redis.set(self.prefix + key, value, px=int(ttl * 1000), nx=True))
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+    def incr(self, key, ttl):
+        # create the counter with its TTL first so a crash can never leave one that lives forever
+        pipe = self._redis.pipeline()
+        pipe.set(self.prefix + key, 0, px=int(ttl * 1000), nx=True)
+        pipe.incr(self.prefix + key)
+        return pipe.execute()[1]
+
+    def take(self, key, cost, capacity, rate):
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate, cost]))
+
+def make_state(url, max_keys=STATE_MAX_KEYS):
+    if not url or url.startswith("memory:"):
+        return MemoryState(max_keys)
+    if url.startswith("shm:"):
+        folder = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        return SQLiteState(os.path.join(folder, "syrixrm-state.db"))
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url)
+    raise ValueError(f"unsupported SYRIXRM_STATE_URL: {url}")
+
+class StateSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.loaded_user = self.get("user_id")
+
+class StateSessionInterface(SessionInterface):
+    """Server-side sessions: the cookie holds a random id and the data lives in the shared state.
+
+    The id is replaced whenever the logged-in user changes, so a planted cookie can't be
+    carried across a login (session fixation).
+    """
+
+    def __init__(self, state, prefix="session:"):
+        self.state = state
+        self.prefix = prefix
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                data = self.state.get(self.prefix + sid)
+            except Exception as e:
+                log.warning("session store unavailable: %s", e)
+                data = None
+            if data is not None:
+                return StateSession(json.loads(data), sid)
+        return StateSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.state.delete(self.prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not (session.modified or session.new):
+            return
+        if session.get("user_id") != session.loaded_user and not session.new:
+            self.state.delete(self.prefix + session.sid)
+            session.sid = secrets.token_urlsafe(32)
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.state.set(self.prefix + session.sid, json.dumps(dict(session)).encode("utf-8"), ttl)
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app), domain=domain, path=path)
+
+# === PASSWORD HASHING ===
+# bcrypt runs on a small dedicated pool; SYRIXRM_PASSWORD_WORKERS=0 hashes inline
+PASSWORD_WORKERS = int(os.getenv("SYRIXRM_PASSWORD_WORKERS", "2"))
+PASSWORD_QUEUE = int(os.getenv("SYRIXRM_PASSWORD_QUEUE", "16"))
+# failed logins per client address (the one ProxyFix resolves) and per email; successes aren't
+# counted, so users sharing a NAT address only lock each other out by guessing wrong
+LOGIN_IP_LIMIT = int(os.getenv("SYRIXRM_LOGIN_IP_LIMIT", "20"))
+LOGIN_IP_WINDOW = int(os.getenv("SYRIXRM_LOGIN_IP_WINDOW", "60"))
+LOGIN_EMAIL_LIMIT = int(os.getenv("SYRIXRM_LOGIN_EMAIL_LIMIT", "5"))
+LOGIN_EMAIL_WINDOW = int(os.getenv("SYRIXRM_LOGIN_EMAIL_WINDOW", "900"))
+
+class HasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    """Runs bcrypt on a size-limited pool and refuses work once workers + queue are full."""
+
+    def __init__(self, workers, max_queue):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt") if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers > 0 else None
+        self.rejected = 0
+
+    def _run(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(bcrypt.generate_password_hash, password, current_app.config['BCRYPT_LOG_ROUNDS']).decode("utf-8")
+
+    def check(self, pw_hash, password):
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    @staticmethod
+    def needs_rehash(pw_hash):
+        # $2b$<cost>$<salt+hash>
+        try:
+            return int(pw_hash.split("$")[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
+        except (IndexError, ValueError):
+            return False
+
+class AttemptLimiter:
+    """At most max_attempts hits per key in a window that opens with the key's first hit."""
+
+    def __init__(self, state, name, max_attempts, window):
+        self.state = state
+        self.name = name
+        self.max_attempts = max_attempts
+        self.window = window
+
+    def allowed(self, key):
+        try:
+            return int(self.state.get(f"{self.name}:{key}") or 0) < self.max_attempts
+        except Exception as e:
+            # fail open like admission control: a lost store must not lock everyone out
+            log.warning("attempt limiter store unavailable: %s", e)
+            return True
+
+    def hit(self, key):
+        try:
+            self.state.incr(f"{self.name}:{key}", self.window)
+        except Exception as e:
+            log.warning("attempt limiter store unavailable: %s", e)
+
+    def reset(self, key):
+        try:
+            self.state.delete(f"{self.name}:{key}")
+        except Exception as e:
+            log.warning("attempt limiter store unavailable: %s", e)
+
+# === ADMISSION CONTROL ===
+# per-minute budgets, refilled continuously; a full minute's worth may arrive as a burst.
+# Guests are keyed by IP, registered users by user_id. 0 turns a bucket off.
+GUEST_RPM = int(os.getenv("SYRIXRM_GUEST_RPM", "10"))
+GUEST_TPM = int(os.getenv("SYRIXRM_GUEST_TPM", "10000"))
+USER_RPM = int(os.getenv("SYRIXRM_USER_RPM", "60"))
+USER_TPM = int(os.getenv("SYRIXRM_USER_TPM", "200000"))
+# buckets live in the shared state; SYRIXRM_ADMISSION_URL gives them a store of their own
+ADMISSION_URL = os.getenv("SYRIXRM_ADMISSION_URL")
+
+class AdmissionControl:
+    """Request-count and prompt-token buckets in front of /chat, with separate guest and user tiers."""
+
+    def __init__(self, store, tiers):
+        self.store = store
+        self.tiers = tiers
+
+    @staticmethod
+    def identity(user_id, ip):
+        return ("user", f"user:{user_id}") if user_id else ("guest", f"ip:{ip}")
+
+    def _take(self, bucket, user_id, ip, cost):
+        tier, key = self.identity(user_id, ip)
+        limit = getattr(self.tiers[tier], bucket)
+        if limit <= 0:
+            return 0.0
+        try:
+            # a prompt larger than the whole bucket still gets through once it is full
+            wait = self.store.take(f"bucket:{bucket}:{key}", min(cost, limit), limit, limit / 60)
+        except Exception as e:
+            # fail open: losing the store shouldn't take /chat down with it
+            log.warning("admission store unavailable: %s", e)
+            return 0.0
+        if wait:
+            ADMISSION_REJECTED.labels(tier, bucket).inc()
+        return wait
+
+    def admit_request(self, user_id, ip):
+        return self._take("requests", user_id, ip, 1)
+
+    def admit_tokens(self, user_id, ip, tokens):
+        return self._take("tokens", user_id, ip, tokens)
+
+def make_admission(config, state):
+    tiers = {
+        "guest": SimpleNamespace(requests=config["SYRIXRM_GUEST_RPM"], tokens=config["SYRIXRM_GUEST_TPM"]),
+        "user": SimpleNamespace(requests=config["SYRIXRM_USER_RPM"], tokens=config["SYRIXRM_USER_TPM"]),
+    }
+    url = config["SYRIXRM_ADMISSION_URL"]
+    return AdmissionControl(make_state(url) if url else state, tiers)
+
+def retry_after_header(wait):
+    return str(max(1, math.ceil(wait)))
+
+# === COMPLETION CACHE ===
+class CompletionCache:
+    """Exact-match reply cache keyed by model + the full message list sent upstream."""
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, messages):
+        raw = json.dumps([model, messages], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        CACHE_LOOKUPS.labels(name).inc()
+
+    def get(self, model, messages, bypass=False):
+        if self.backend is None:
+            return None
+        if bypass:
+            self._count("bypassed")
+            return None
+        value = self.lookup(self.key(model, messages))
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def lookup(self, key):
+        """The cached reply under key, without counting a hit or miss."""
+        try:
+            value = self.backend.get("completion:" + key)
+        except Exception as e:
+            log.warning("completion cache read failed: %s", e)
+            return None
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, model, messages, reply):
+        if self.backend is None or not reply:
+            return
+        try:
+            self.backend.set("completion:" + self.key(model, messages), reply.encode("utf-8"), self.ttl)
+        except Exception as e:
+            log.warning("completion cache write failed: %s", e)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bypassed": self.bypassed,
+                "entries": len(self.backend) if isinstance(self.backend, MemoryState) else None}
+
+def make_cache_backend(config, state):
+    if config["SYRIXRM_CACHE_URL"]:
+        return make_state(config["SYRIXRM_CACHE_URL"])
+    if config["SYRIXRM_CACHE_SIZE"] <= 0:
+        return None
+    # a node- or cluster-wide state store shares the cache too; otherwise an LRU of CACHE_SIZE entries
+    return state if state.shared else MemoryState(config["SYRIXRM_CACHE_SIZE"])
+
+def cache_bypassed(payload, cache_control):
+    # {"cache": false} in the body or a Cache-Control: no-cache header forces a fresh answer
+    return payload.get("cache") is False or "no-cache" in (cache_control or "")
+
+# === UPSTREAM ROUTING ===
+# every call has a deadline; retryable failures are retried with full-jitter backoff, an
+# attempt slower than the recent p95 gets a hedged duplicate (first answer wins), and a
+# route that keeps failing or crawling is skipped in favour of the fallback for a while
+UPSTREAM_TIMEOUT = float(os.getenv("SYRIXRM_UPSTREAM_TIMEOUT", "60"))
+# per attempt; for streams it bounds the wait for each chunk rather than the whole answer
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("SYRIXRM_UPSTREAM_ATTEMPT_TIMEOUT", "20"))
+UPSTREAM_RETRIES = int(os.getenv("SYRIXRM_UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BASE = float(os.getenv("SYRIXRM_UPSTREAM_RETRY_BASE", "0.25"))
+UPSTREAM_THREADS = int(os.getenv("SYRIXRM_UPSTREAM_THREADS", "64"))
+
+# SYRIXRM_HEDGE=0 turns hedging off; SYRIXRM_HEDGE_AFTER_MS pins the delay instead of the quantile
+HEDGE_ENABLED = os.getenv("SYRIXRM_HEDGE", "1") != "0"
+HEDGE_QUANTILE = float(os.getenv("SYRIXRM_HEDGE_QUANTILE", "0.95"))
+HEDGE_AFTER_MS = float(os.getenv("SYRIXRM_HEDGE_AFTER_MS", "0"))
+HEDGE_MIN_MS = float(os.getenv("SYRIXRM_HEDGE_MIN_MS", "200"))
+# used until enough calls have been seen to trust the quantile
+HEDGE_DEFAULT_MS = float(os.getenv("SYRIXRM_HEDGE_DEFAULT_MS", "5000"))
+
+# a second model, optionally on another OpenAI-compatible endpoint
+FALLBACK_MODEL = os.getenv("SYRIXRM_FALLBACK_MODEL")
+FALLBACK_BASE_URL = os.getenv("SYRIXRM_FALLBACK_BASE_URL")
+FALLBACK_API_KEY = os.getenv("SYRIXRM_FALLBACK_API_KEY")
+FALLBACK_ERROR_RATE = float(os.getenv("SYRIXRM_FALLBACK_ERROR_RATE", "0.5"))
+FALLBACK_LATENCY_MS = float(os.getenv("SYRIXRM_FALLBACK_LATENCY_MS", "0"))
+FALLBACK_COOLDOWN = float(os.getenv("SYRIXRM_FALLBACK_COOLDOWN", "30"))
+
+class UpstreamTimeout(Exception):
+    pass
+
+def retryable(error):
+    if isinstance(error, (UpstreamTimeout, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+def backoff(attempt):
+    return random.uniform(0, UPSTREAM_RETRY_BASE * 2 ** attempt)
+
+class LatencyTracker:
+    """Rolling window of recent call latencies."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class RouteHealth:
+    """Recent outcomes of one route; it counts as degraded for a cooldown after misbehaving."""
+
+    def __init__(self, error_rate, latency, cooldown, window=50, min_samples=10):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker(window)
+        self._outcomes = deque(maxlen=window)
+        self._degraded_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ok, seconds):
+        if ok:
+            self.latencies.add(seconds)
+        with self._lock:
+            self._outcomes.append(ok)
+            if len(self._outcomes) < self.min_samples or self.degraded():
+                return
+            errors = self._outcomes.count(False) / len(self._outcomes)
+            slow = self.latency and (self.latencies.quantile(0.95, self.min_samples) or 0) > self.latency
+            if errors >= self.error_rate or slow:
+                self._degraded_until = time.monotonic() + self.cooldown
+                # after the cooldown the route starts over with a clean record
+                self._outcomes.clear()
+
+    def degraded(self):
+        return time.monotonic() < self._degraded_until
+
+class UpstreamRoute:
+    """A model on an endpoint, with its own health record."""
+
+    def __init__(self, name, model, clients, base_url=None, api_key=None):
+        self.name = name
+        self.model = model
+        self.clients = clients
+        self.base_url = base_url
+        self.api_key = api_key
+        self.health = RouteHealth(FALLBACK_ERROR_RATE, FALLBACK_LATENCY_MS / 1000, FALLBACK_COOLDOWN)
+
+    def client(self):
+        return self.clients.get(self.base_url, self.api_key)
+
+def close_stream(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+class UpstreamRouter:
+    """Deadlines, jittered retries, hedged duplicates and model fallback around chat completions.
+
+    Attempts go to the primary route, or to the fallback first while the primary is
+    degraded; once one route's retries are spent the next route gets the rest of the
+    deadline. A hedged duplicate is launched when an attempt outlives the recent
+    HEDGE_QUANTILE latency (time to first token for streams), counted from when the
+    attempt gets a pool thread; no duplicate is launched while the pool has no idle
+    thread. For streams only the opening of the stream is retried or hedged: once
+    text has gone out it is final.
+    """
+
+    def __init__(self, routes, timeout=UPSTREAM_TIMEOUT, attempt_timeout=UPSTREAM_ATTEMPT_TIMEOUT,
+                 retries=UPSTREAM_RETRIES, hedge=HEDGE_ENABLED, threads=UPSTREAM_THREADS):
+        self.routes = routes
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.latency = {"complete": LatencyTracker(), "stream": LatencyTracker()}
+        self.threads = threads
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="upstream")
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+
+    def ordered_routes(self):
+        if len(self.routes) > 1 and self.routes[0].health.degraded():
+            return self.routes[1:] + self.routes[:1]
+        return self.routes
+
+    def hedge_delay(self, kind):
+        if HEDGE_AFTER_MS:
+            return HEDGE_AFTER_MS / 1000
+        delay = self.latency[kind].quantile(HEDGE_QUANTILE)
+        return max(HEDGE_MIN_MS / 1000, delay if delay is not None else HEDGE_DEFAULT_MS / 1000)
+
+    def _run(self, attempt):
+        """Call attempt(route, timeout) until it succeeds, the routes run out or the deadline passes."""
+        deadline = time.monotonic() + self.timeout
+        error = None
+        for route in self.ordered_routes():
+            for n in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise error or UpstreamTimeout()
+                try:
+                    return attempt(route, min(remaining, self.attempt_timeout))
+                except Exception as e:
+                    if not retryable(e):
+                        raise
+                    error = e
+                    log.warning("upstream %s attempt %d failed: %s", route.name, n + 1, e)
+                if n < self.retries:
+                    time.sleep(min(backoff(n), max(0.0, deadline - time.monotonic())))
+        raise error or UpstreamTimeout()
+
+    def _timed(self, route, kind, call):
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            elapsed = time.perf_counter() - started
+            route.health.record(False, elapsed)
+            UPSTREAM_ATTEMPTS.labels(route.name, "error").inc()
+            raise
+        elapsed = time.perf_counter() - started
+        route.health.record(True, elapsed)
+        self.latency[kind].add(elapsed)
+        UPSTREAM_ATTEMPTS.labels(route.name, "ok").inc()
+        return result
+
+    def _submit(self, call, started):
+        def run():
+            started.set()
+            return call()
+        with self._busy_lock:
+            self._busy += 1
+        future = self._pool.submit(run)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        # also runs for a future cancelled before it got a thread
+        with self._busy_lock:
+            self._busy -= 1
+
+    @staticmethod
+    def _abandon(futures, discard):
+        for future in futures:
+            # a blocking call can't be interrupted; a losing stream is closed once it opens
+            if not future.cancel() and discard is not None:
+                future.add_done_callback(lambda f: not f.cancelled() and f.exception() is None and discard(f.result()))
+
+    def _hedged(self, kind, call, timeout, discard=None):
+        """Run call() on the pool, duplicating it if it is slow; the first success within timeout wins."""
+        if not self.hedge:
+            return call()
+        deadline = time.monotonic() + timeout
+        started = threading.Event()
+        futures = [self._submit(call, started)]
+        # time spent queued for a thread doesn't count towards the hedge delay
+        started.wait(timeout)
+        remaining = deadline - time.monotonic()
+        done, _ = wait(futures, timeout=max(0.0, min(self.hedge_delay(kind), remaining)))
+        if not done and deadline > time.monotonic():
+            if self._busy < self.threads:
+                UPSTREAM_HEDGES.labels("launched").inc()
+                futures.append(self._submit(call, threading.Event()))
+            else:
+                # every thread is taken: a duplicate would only queue behind the backlog
+                UPSTREAM_HEDGES.labels("skipped").inc()
+        error = None
+        try:
+            for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is not futures[0]:
+                    UPSTREAM_HEDGES.labels("won").inc()
+                self._abandon([f for f in futures if f is not future], discard)
+                return result
+        except TimeoutError:
+            self._abandon(futures, discard)
+            raise UpstreamTimeout(f"no reply within {timeout:.1f}s") from None
+        raise error
+
+    def complete(self, messages, hedge=True, **kwargs):
+        def attempt(route, timeout):
+            def call():
+                return self._timed(route, "complete", lambda: route.client().chat.completions.create(
+                    model=route.model, messages=messages, timeout=timeout, **kwargs))
+            return self._hedged("complete", call, timeout) if hedge else call()
+        return self._run(attempt)
+
+    def _open(self, route, messages, timeout, kwargs):
+        # opened once the first text arrives, so a stalled stream can still be retried or hedged
+        def call():
+            stream = route.client().chat.completions.create(
+                model=route.model, messages=messages, stream=True, timeout=timeout, **kwargs)
+            chunks = []
+            iterator = iter(stream)
+            for chunk in iterator:
+                chunks.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+            return stream, iterator, chunks
+        return self._timed(route, "stream", call)
+
+    def stream(self, messages, **kwargs):
+        def attempt(route, timeout):
+            return self._hedged("stream", lambda: self._open(route, messages, timeout, kwargs), timeout,
+                                discard=lambda opened: close_stream(opened[0]))
+        stream, iterator, chunks = self._run(attempt)
+        try:
+            yield from chunks
+            yield from iterator
+        finally:
+            close_stream(stream)
+
+def make_router(config, clients):
+    routes = [UpstreamRoute("primary", MODEL, clients)]
+    if config["SYRIXRM_FALLBACK_MODEL"]:
+        routes.append(UpstreamRoute("fallback", config["SYRIXRM_FALLBACK_MODEL"], clients,
+                                    config["SYRIXRM_FALLBACK_BASE_URL"], config["SYRIXRM_FALLBACK_API_KEY"]))
+    return UpstreamRouter(routes, config["SYRIXRM_UPSTREAM_TIMEOUT"], config["SYRIXRM_UPSTREAM_ATTEMPT_TIMEOUT"],
+                          config["SYRIXRM_UPSTREAM_RETRIES"], config["SYRIXRM_HEDGE"], config["SYRIXRM_UPSTREAM_THREADS"])
+
+# === SINGLE-FLIGHT ===
+class StreamFlight:
+    """One upstream stream fanned out to every subscriber; late joiners replay from the start."""
+
+    def __init__(self):
+        self.deltas = []
+        self.finished = False
+        self.error = None
+        self._changed = threading.Condition()
+
+    def pump(self, source):
+        try:
+            for delta in source:
+                with self._changed:
+                    self.deltas.append(delta)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    def follow(self):
+        i = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: i < len(self.deltas) or self.finished)
+                new = self.deltas[i:]
+                finished = self.finished
+            yield from new
+            i += len(new)
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+class SingleFlight:
+    """Coalesces identical in-flight upstream calls: the first caller runs it, the rest share its result."""
+
+    def __init__(self):
+        self.deduplicated = 0
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SimpleNamespace(done=threading.Event(), result=None, error=None)
+            else:
+                self.deduplicated += 1
+                DEDUPLICATED.inc()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stream(self, key, start):
+        # upstream is read on its own thread so a subscriber hanging up doesn't cut off the others
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = self._streams[key] = StreamFlight()
+                threading.Thread(target=self._pump, args=(key, flight, start), daemon=True).start()
+            else:
+                self.deduplicated += 1
+                DEDUPLICATED.inc()
+        return flight.follow()
+
+    def _pump(self, key, flight, start):
+        try:
+            flight.pump(start())
+        finally:
+            with self._lock:
+                del self._streams[key]
+
+# SingleFlight only sees this process; with a shared state the first process to claim a
+# prompt calls upstream and the others wait for its reply to land in the completion cache
+FLIGHT_POLL_MAX = 0.5
+
+def shared_flight(key, fn):
+    state, cache, timeout = services().state, services().cache, services().router.timeout
+    # other processes can only see the reply if the cache itself is shared, not just the claim
+    if not state.shared or not getattr(cache.backend, "shared", False):
+        return fn()
+    claim = "flight:" + key
+    deadline = time.monotonic() + timeout
+    delay = 0.02
+    while True:
+        try:
+            if state.add(claim, b"1", timeout):
+                break
+        except Exception as e:
+            log.warning("single-flight claim failed: %s", e)
+            return fn()
+        reply = cache.lookup(key)
+        if reply is not None:
+            DEDUPLICATED.inc()
+            return reply
+        if time.monotonic() > deadline:
+            return fn()
+        time.sleep(delay)
+        delay = min(delay * 2, FLIGHT_POLL_MAX)
+    try:
+        # the previous holder may have filled the cache just before releasing its claim
+        reply = cache.lookup(key)
+        if reply is not None:
+            DEDUPLICATED.inc()
+            return reply
+        return fn()
+    finally:
+        try:
+            state.delete(claim)
+        except Exception:
+            pass  # the claim expires on its own
+
+def upstream_complete(history):
+    started = time.perf_counter()
+    try:
+        # OpenAI çağrısı
+        response = services().router.complete(history)
+    except Exception:
+        UPSTREAM_LATENCY.labels("complete", "error").observe(time.perf_counter() - started)
+        raise
+    UPSTREAM_LATENCY.labels("complete", "ok").observe(time.perf_counter() - started)
+    record_usage("chat", getattr(response, "usage", None))
+    reply = response.choices[0].message.content
+    services().cache.set(MODEL, history, reply)
+    return reply
+
+def upstream_deltas(router, history):
+    # runs on the single-flight pump thread, outside the app context, so it gets the router
+    # passed in and reports straight to the histograms
+    started = time.perf_counter()
+    first = None
+    outcome = "error"
+    try:
+        for chunk in router.stream(history, stream_options={"include_usage": True}):
+            record_usage("chat", getattr(chunk, "usage", None))
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first is None:
+                    first = time.perf_counter()
+                    UPSTREAM_TTFT.observe(first - started)
+                yield chunk.choices[0].delta.content
+        outcome = "ok"
+    finally:
+        UPSTREAM_LATENCY.labels("stream", outcome).observe(time.perf_counter() - started)
+
+def complete(history, bypass_cache=False):
+    cache = services().cache
+    reply = cache.get(MODEL, history, bypass=bypass_cache)
+    if reply is not None:
+        return reply, True
+    key = cache.key(MODEL, history)
+
+    def call():
+        return upstream_complete(history)
+    # a bypassing caller must not be handed another process's cached reply
+    return services().inflight.do(key, call if bypass_cache else lambda: shared_flight(key, call)), False
+
+# === STATIC ASSETS ===
+class StaticAsset:
+    """A static file loaded once, fingerprinted by content and precompressed in memory."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            body = f.read()
+        stem, ext = os.path.splitext(os.path.basename(path))
+        self.etag = hashlib.sha256(body).hexdigest()[:12]
+        self.url_name = f"{stem}.{self.etag}{ext}"
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.variants = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body)
+
+    def pick_encoding(self, accept_encodings):
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return "identity"
+
+def load_assets(folder):
+    assets = {}
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path):
+            assets[name] = StaticAsset(path)
+    return assets
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def asset_url(name):
+    return "/assets/" + current_app.extensions["syrixrm"].assets[name].url_name
+
+@bp.app_context_processor
+def inject_asset_url():
+    return {"asset_url": asset_url}
+
+@bp.route("/assets/<name>")
+def assets(name):
+    asset = current_app.extensions["syrixrm"].assets_by_url.get(name)
+    if asset is None:
+        return "Not found.", 404
+    encoding = asset.pick_encoding(request.accept_encodings)
+    etag = f"{asset.etag}-{encoding}"
+    headers = {"Cache-Control": f"public, max-age={ASSET_MAX_AGE}, immutable", "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match:
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    return response
+
+# === COLD STORAGE ===
+# `flask compact` moves messages that are older than ARCHIVE_AFTER_DAYS and already folded
+# into the user's ConversationSummary into compressed MessageArchive blocks. build_context()
+# never reads below the summary, so only /history and exports open the blocks; the search
+# index keeps its own copy of archived messages, so /search still finds them.
+ARCHIVE_AFTER_DAYS = int(os.getenv("SYRIXRM_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BLOCK_SIZE = int(os.getenv("SYRIXRM_ARCHIVE_BLOCK_SIZE", "500"))
+# every block records its codec, so switching later keeps older blocks readable
+ARCHIVE_CODEC = os.getenv("SYRIXRM_ARCHIVE_CODEC", "zstd" if zstandard is not None else "zlib")
+
+def compress_block(raw, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(raw)
+    return zlib.compress(raw, 9)
+
+def archived_rows(block):
+    """[id, role, content, timestamp, tokens] rows of a block, oldest first; timestamp is ISO text."""
+    if block.codec == "zstd":
+        raw = zstandard.ZstdDecompressor().decompress(block.data)
+    else:
+        raw = zlib.decompress(block.data)
+    return json.loads(raw)
+
+def archived_page(user_id, limit, before_id=None, since_id=None):
+    """Up to limit archived messages as /history dicts, oldest first; the cursors work as in /history."""
+    query = MessageArchive.query.filter_by(user_id=user_id)
+    page = []
+    if since_id is not None:
+        blocks = query.filter(MessageArchive.last_id > since_id).order_by(MessageArchive.first_id)
+        for block in blocks.yield_per(4):
+            page += [row for row in archived_rows(block) if row[0] > since_id][:limit - len(page)]
+            if len(page) >= limit:
+                break
+    else:
+        if before_id is not None:
+            query = query.filter(MessageArchive.first_id < before_id)
+        for block in query.order_by(MessageArchive.last_id.desc()).yield_per(4):
+            rows = [row for row in archived_rows(block) if before_id is None or row[0] < before_id]
+            page = rows[-(limit - len(page)):] + page
+            if len(page) >= limit:
+                break
+    return [{"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3]} for row in page]
+
+def compact_user(user_id, cutoff, block_size, codec, totals):
+    summary = db.session.get(ConversationSummary, user_id)
+    newest = db.session.scalar(db.select(db.func.max(Message.id)).where(Message.user_id == user_id))
+    if summary is None or newest is None:
+        return
+    first_recent = db.session.scalar(
+        db.select(db.func.min(Message.id)).where(Message.user_id == user_id, Message.timestamp >= cutoff))
+    # the archive stays a prefix of the user's ids, and the newest row stays hot so SQLite
+    # never hands out an archived id again
+    bound = min(summary.last_message_id, newest - 1, (first_recent or newest) - 1)
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                db.select(Message.id, Message.role, Message.content, Message.timestamp, Message.tokens)
+                .where(Message.user_id == user_id, Message.id <= bound).order_by(Message.id).limit(block_size)).all()
+            if not rows:
+                return
+            raw = json.dumps([[r.id, r.role, r.content, r.timestamp.isoformat() if r.timestamp else None, r.tokens]
+                              for r in rows], ensure_ascii=False).encode("utf-8")
+            data = compress_block(raw, codec)
+            conn.execute(insert(MessageArchive).values(
+                user_id=user_id, first_id=rows[0].id, last_id=rows[-1].id, count=len(rows), codec=codec,
+                raw_bytes=len(raw), data=data))
+            deleted = conn.execute(db.delete(Message).where(
+                Message.user_id == user_id, Message.id.between(rows[0].id, rows[-1].id))).rowcount
+            if deleted != len(rows):
+                raise RuntimeError(f"messages of user {user_id} changed while compacting; run one compaction at a time")
+        totals.messages += len(rows)
+        totals.blocks += 1
+        totals.raw_bytes += len(raw)
+        totals.stored_bytes += len(data)
+
+def compact_messages(cutoff, block_size=ARCHIVE_BLOCK_SIZE, codec=ARCHIVE_CODEC):
+    """Archive every user's summarized messages older than cutoff, one transaction per block."""
+    totals = SimpleNamespace(messages=0, blocks=0, raw_bytes=0, stored_bytes=0)
+    for user_id in db.session.scalars(db.select(ConversationSummary.user_id).order_by(ConversationSummary.user_id)).all():
+        compact_user(user_id, cutoff, block_size, codec, totals)
+    return totals
+
+def storage_bytes():
+    """Page usage of the hot message table, the archive and the whole file; None where SQLite's dbstat is missing."""
+    if db.engine.dialect.name != "sqlite":
+        return None
+    with db.engine.connect() as conn:
+        try:
+            sizes = dict(conn.execute(db.text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+        except OperationalError:
+            return None
+        page_size = conn.execute(db.text("PRAGMA page_size")).scalar()
+        pages = conn.execute(db.text("PRAGMA page_count")).scalar()
+        free = conn.execute(db.text("PRAGMA freelist_count")).scalar()
+
+    def table(model):
+        return sizes.get(model.__tablename__, 0) + sum(sizes.get(index.name, 0) for index in model.__table__.indexes)
+    return SimpleNamespace(hot=table(Message), archive=table(MessageArchive),
+                           used=(pages - free) * page_size, file=pages * page_size)
+
+def megabytes(n):
+    return f"{n / 1e6:.1f} MB"
+
+@click.command("compact")
+@click.option("--older-than-days", default=ARCHIVE_AFTER_DAYS, show_default=True)
+@click.option("--block-size", default=ARCHIVE_BLOCK_SIZE, show_default=True)
+@click.option("--vacuum", is_flag=True, help="Rewrite the database file so freed pages go back to the OS.")
+@with_appcontext
+def compact_command(older_than_days, block_size, vacuum):
+    """Move old, already summarized messages into compressed archive blocks."""
+    if ARCHIVE_CODEC == "zstd" and zstandard is None:
+        raise click.ClickException("SYRIXRM_ARCHIVE_CODEC=zstd needs the zstandard package.")
+    before = storage_bytes()
+    totals = compact_messages(datetime.utcnow() - timedelta(days=older_than_days), block_size)
+    click.echo(f"Archived {totals.messages} messages in {totals.blocks} blocks "
+               f"({megabytes(totals.raw_bytes)} of rows stored as {megabytes(totals.stored_bytes)} {ARCHIVE_CODEC}).")
+    if vacuum:
+        raw = db.engine.raw_connection()
+        try:
+            raw.execute("VACUUM")
+        finally:
+            raw.close()
+    after = storage_bytes()
+    if before is None or after is None:
+        return
+    click.echo(f"Hot message table and indexes: {megabytes(before.hot)} -> {megabytes(after.hot)}; "
+               f"archive: {megabytes(before.archive)} -> {megabytes(after.archive)}.")
+    click.echo(f"Reclaimed {megabytes(before.used - after.used)} of pages; database file "
+               f"{megabytes(before.file)} -> {megabytes(after.file)}"
+               + ("." if vacuum else " (freed pages are reused by new rows; --vacuum shrinks the file)."))
+
+# === SEMANTIC MEMORY ===
+# every stored message is embedded in the background into a per-user file of float16
+# vectors; build_context() recalls the best matches from before the recent window, so a
+# fact mentioned weeks ago can come back without the user repeating it
+MEMORY_TOKEN_BUDGET = int(os.getenv("SYRIXRM_MEMORY_TOKENS", "400"))
+MEMORY_TOP_K = int(os.getenv("SYRIXRM_MEMORY_TOP_K", "8"))
+MEMORY_MIN_SCORE = float(os.getenv("SYRIXRM_MEMORY_MIN_SCORE", "0.3"))
+MEMORY_DIMS = int(os.getenv("SYRIXRM_MEMORY_DIMS", "256"))
+MEMORY_BATCH = int(os.getenv("SYRIXRM_MEMORY_BATCH", "64"))
+MEMORY_MAX_CHARS = 8000
+# vectors are scored this many rows at a time so a query never copies a whole file
+MEMORY_SCAN_ROWS = 16384
+MEMORY_OPEN_FILES = 256
+EMBEDDING_MODEL = os.getenv("SYRIXRM_EMBEDDING_MODEL", "text-embedding-3-small")
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+class HashEmbedder:
+    """Deterministic local embedder (signed feature hashing of words and word pairs) for tests and benchmarks."""
+
+    name = "hash"
+
+    def __init__(self, dims=MEMORY_DIMS):
+        self.dims = dims
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, h % self.dims] += 1.0 if h >> 63 else -1.0
+        return normalize(vectors)
+
+class OpenAIEmbedder:
+    """Embeddings API vectors, shortened to dims (text-embedding-3 models support that natively)."""
+
+    def __init__(self, model=EMBEDDING_MODEL, dims=MEMORY_DIMS):
+        self.name = model
+        self.model = model
+        self.dims = dims
+
+    def embed(self, texts):
+        response = llm_client().embeddings.create(model=self.model, input=texts, dimensions=self.dims)
+        return normalize(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+def make_embedder(spec, fake=False):
+    spec = spec or ("hash" if fake else "openai")
+    if spec == "hash":
+        return HashEmbedder()
+    if spec == "openai":
+        return OpenAIEmbedder()
+    # anything with .name, .dims and .embed(texts) -> (n, dims) array of unit vectors
+    module, _, factory = spec.partition(":")
+    return getattr(importlib.import_module(module), factory)()
+
+class MemoryIndex:
+    """Per-user message embeddings in append-only files of (message id, float16 vector) records.
+
+    Files are read through memory maps, so the page cache is shared by every worker. Records
+    are appended in id order under an flock and vectors are unit length, so a dot product is
+    the cosine score and ids below a cursor are a prefix. Per-user files stay small enough
+    for an exact scan, so there is no approximate (IVF) layer.
+    """
+
+    def __init__(self, folder, embedder, batch_size=MEMORY_BATCH):
+        self.embedder = embedder
+        self.batch_size = batch_size
+        name = getattr(embedder, "name", type(embedder).__name__)
+        # one folder per embedding space: vectors from different embedders can't be compared
+        self.folder = os.path.join(folder, f"{name}-{embedder.dims}")
+        self.record = np.dtype([("id", "<i8"), ("vector", "<f2", (embedder.dims,))])
+        self._maps = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def path(self, user_id):
+        return os.path.join(self.folder, f"{int(user_id)}.mem")
+
+    def records(self, user_id):
+        """A read-only map of the user's records, reopened when another process has appended."""
+        try:
+            count = os.path.getsize(self.path(user_id)) // self.record.itemsize
+        except FileNotFoundError:
+            return None
+        if not count:
+            return None
+        with self._lock:
+            records = self._maps.get(user_id)
+            if records is None or len(records) != count:
+                records = np.memmap(self.path(user_id), dtype=self.record, mode="r", shape=(count,))
+            self._maps[user_id] = records
+            self._maps.move_to_end(user_id)
+            while len(self._maps) > MEMORY_OPEN_FILES:
+                self._maps.popitem(last=False)
+        return records
+
+    def last_id(self, user_id):
+        records = self.records(user_id)
+        return int(records["id"][-1]) if records is not None else 0
+
+    def append(self, user_id, ids, vectors):
+        records = np.empty(len(ids), dtype=self.record)
+        records["id"] = ids
+        records["vector"] = vectors
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.path(user_id), "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            # drop a torn record left by a crashed writer, and ids another worker already added
+            size -= size % self.record.itemsize
+            f.truncate(size)
+            if size:
+                f.seek(size - self.record.itemsize)
+                last = np.frombuffer(f.read(self.record.itemsize), dtype=self.record)["id"][0]
+                records = records[records["id"] > last]
+            f.write(records.tobytes())
+
+    def index(self, user_id):
+        """Embed the user's messages stored since the last indexed id; returns how many were added."""
+        added = 0
+        while True:
+            rows = db.session.execute(
+                db.select(Message.id, Message.content)
+                .where(Message.user_id == user_id, Message.id > self.last_id(user_id))
+                .order_by(Message.id).limit(self.batch_size)).all()
+            if not rows:
+                return added
+            vectors = self.embedder.embed([(r.content or " ")[:MEMORY_MAX_CHARS] for r in rows])
+            self.append(user_id, [r.id for r in rows], vectors)
+            added += len(rows)
+
+    def search(self, user_id, text, k, before_id):
+        """The k best (message id, score) pairs among ids below before_id, best first."""
+        records = self.records(user_id)
+        if records is None:
+            return []
+        count = int(np.searchsorted(records["id"], before_id))
+        if not count:
+            return []
+        query = self.embedder.embed([text])[0].astype(np.float32)
+        ids, scores = [], []
+        for start in range(0, count, MEMORY_SCAN_ROWS):
+            chunk = records[start:min(count, start + MEMORY_SCAN_ROWS)]
+            chunk_scores = chunk["vector"].astype(np.float32) @ query
+            top = np.argpartition(-chunk_scores, k)[:k] if len(chunk_scores) > k else slice(None)
+            ids.append(chunk["id"][top])
+            scores.append(chunk_scores[top])
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        return [(int(ids[i]), float(scores[i])) for i in np.argsort(-scores)[:k]]
+
+    def schedule(self, app, user_id):
+        """Index user_id's new messages on this process's memory thread."""
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+            # (re)created lazily so forked gunicorn workers get their own thread
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+                self._executor_pid = os.getpid()
+        try:
+            self._executor.submit(self._index_safely, app, user_id)
+        except RuntimeError:
+            # interpreter is shutting down; the next write for this user catches up
+            pass
+
+    def _index_safely(self, app, user_id):
+        with self._lock:
+            self._pending.discard(user_id)
+        with app.app_context():
+            try:
+                self.index(user_id)
+            except Exception as e:
+                db.session.rollback()
+                log.warning("memory indexing failed for user %s: %s", user_id, e)
+
+def schedule_memory(app, user_id):
+    memory = app.extensions["syrixrm"].memory
+    if memory is not None:
+        memory.schedule(app, user_id)
+
+def archived_messages(user_id, ids):
+    """{id: (role, content)} for ids that have moved into archive blocks."""
+    found = {}
+    for message_id in ids:
+        if message_id in found:
+            continue
+        block = MessageArchive.query.filter(MessageArchive.user_id == user_id, MessageArchive.first_id <= message_id,
+                                            MessageArchive.last_id >= message_id).first()
+        if block is not None:
+            for row in archived_rows(block):
+                if row[0] in ids:
+                    found[row[0]] = (row[1], row[2])
+    return found
+
+def recall_memories(user_id, text, before_id, budget=MEMORY_TOKEN_BUDGET):
+    """Messages older than before_id that best match text and fit in budget, as (role, content), oldest first."""
+    memory = current_app.extensions["syrixrm"].memory
+    if memory is None or before_id is None:
+        return []
+    try:
+        hits = [(i, score) for i, score in memory.search(user_id, text, MEMORY_TOP_K, before_id)
+                if score >= MEMORY_MIN_SCORE]
+    except Exception as e:
+        # recall is a bonus: a failing embedder must not fail the chat
+        log.warning("memory recall failed for user %s: %s", user_id, e)
+        return []
+    if not hits:
+        return []
+    ids = [i for i, _ in hits]
+    rows = {r.id: (r.role, r.content) for r in db.session.execute(
+        db.select(Message.id, Message.role, Message.content).where(Message.user_id == user_id, Message.id.in_(ids)))}
+    missing = [i for i in ids if i not in rows]
+    if missing:
+        rows.update(archived_messages(user_id, missing))
+    chosen = []
+    used = 0
+    for message_id, _ in hits:
+        if message_id not in rows:
+            continue
+        role, content = rows[message_id]
+        tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens <= budget:
+            chosen.append((message_id, role, content))
+            used += tokens
+    return [(role, content) for _, role, content in sorted(chosen)]
+
+@click.command("memory-backfill")
+@with_appcontext
+def memory_backfill_command():
+    """Embed every stored message that is not in the semantic memory yet."""
+    memory = current_app.extensions["syrixrm"].memory
+    if memory is None:
+        raise click.ClickException("Semantic memory is off; set SYRIXRM_MEMORY=1 (numpy is required).")
+    added = 0
+    for user_id in db.session.scalars(db.select(User.id).order_by(User.id)).all():
+        added += memory.index(user_id)
+    click.echo(f"Embedded {added} messages.")
+
+# === EXPORT / IMPORT ===
+# gzip'd NDJSON, one object per line. /export writes a user's message lines; `flask backup`
+# puts a user line before each user's messages so `flask restore` can recreate the owners.
+EXPORT_BATCH = int(os.getenv("SYRIXRM_EXPORT_BATCH", "1000"))
+IMPORT_BATCH = int(os.getenv("SYRIXRM_IMPORT_BATCH", "1000"))
+
+class InvalidExport(ValueError):
+    pass
+
+def message_lines(user_id):
+    # archived blocks come first: they hold the user's oldest ids
+    blocks = (db.select(MessageArchive.codec, MessageArchive.data).where(MessageArchive.user_id == user_id)
+              .order_by(MessageArchive.first_id).execution_options(yield_per=4))
+    for block in db.session.execute(blocks):
+        for _, role, content, timestamp, _ in archived_rows(block):
+            yield json.dumps({"type": "message", "role": role, "content": content, "timestamp": timestamp},
+                             ensure_ascii=False) + "\n"
+    # plain column rows through a server-side cursor: no ORM objects, constant memory
+    query = (db.select(Message.role, Message.content, Message.timestamp)
+             .where(Message.user_id == user_id).order_by(Message.id)
+             .execution_options(yield_per=EXPORT_BATCH))
+    for m in db.session.execute(query):
+        yield json.dumps({"type": "message", "role": m.role, "content": m.content,
+                          "timestamp": m.timestamp.isoformat() if m.timestamp else None}, ensure_ascii=False) + "\n"
+
+def backup_lines():
+    query = db.select(User.id, User.username, User.email, User.password).order_by(User.id)
+    for user in db.session.execute(query.execution_options(yield_per=EXPORT_BATCH)):
+        yield json.dumps({"type": "user", "username": user.username, "email": user.email,
+                          "password": user.password}, ensure_ascii=False) + "\n"
+        yield from message_lines(user.id)
+
+def gzip_chunks(lines):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for line in lines:
+        chunk = compressor.compress(line.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+def open_export(stream):
+    """Text lines from a binary stream, gunzipped when it starts with the gzip magic bytes."""
+    if not hasattr(stream, "peek"):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+def restore_user(record):
+    user = User.query.filter_by(email=record["email"]).first()
+    if user is None:
+        user = User(username=record["username"], email=record["email"], password=record["password"])
+        db.session.add(user)
+        db.session.commit()
+    return user.id
+
+def import_messages(lines, user_id=None):
+    """Insert exported messages in batched transactions; returns (users, messages) imported.
+
+    With user_id every message goes to that user and user lines are refused. Without it
+    (a backup) each user line picks, or creates, the owner of the messages that follow.
+    """
+    rows = []
+    users = imported = 0
+    owner = user_id
+
+    def flush():
+        nonlocal imported
+        if rows:
+            db.session.execute(insert(Message), rows)
+            db.session.commit()
+            imported += len(rows)
+            rows.clear()
+
+    number = 0
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record.get("type", "message")
+                if kind == "user" and user_id is None:
+                    flush()
+                    owner = restore_user(record)
+                    users += 1
+                elif kind == "message" and owner is not None:
+                    if record["role"] not in ("user", "assistant") or not isinstance(record["content"], str):
+                        raise ValueError("bad role or content")
+                    timestamp = record.get("timestamp")
+                    rows.append({"user_id": owner, "role": record["role"], "content": record["content"],
+                                 "tokens": count_tokens(record["content"]),
+                                 "timestamp": datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow()})
+                else:
+                    raise ValueError(f"unexpected {kind!r} record")
+                if len(rows) >= IMPORT_BATCH:
+                    flush()
+            except (ValueError, KeyError, TypeError, AttributeError, IntegrityError) as e:
+                db.session.rollback()
+                raise InvalidExport(f"line {number}: {e} ({imported} messages imported before it)")
+    except (OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+        # a gzip upload is decoded while lines are read, so a truncated or corrupt one fails here
+        db.session.rollback()
+        raise InvalidExport(f"unreadable after line {number}: {e} ({imported} messages imported before it)")
+    flush()
+    return users, imported
+
+@click.command("backup")
+@click.argument("output", type=click.File("wb"))
+@with_appcontext
+def backup_command(output):
+    """Write every user and message to OUTPUT as gzip'd NDJSON ('-' for stdout)."""
+    writer = message_writer()
+    if writer is not None:
+        writer.flush()
+    for chunk in gzip_chunks(backup_lines()):
+        output.write(chunk)
+
+@click.command("restore")
+@click.argument("source", type=click.File("rb"))
+@with_appcontext
+def restore_command(source):
+    """Load a backup written by `flask backup`; existing users are matched by email."""
+    try:
+        users, imported = import_messages(open_export(source))
+    except InvalidExport as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {imported} messages for {users} users.")
+
+# === ROUTES ===
+@bp.route("/")
+def root():
+    username = session.get("username")
+    guest_session_id()
+    return render_template("chat.html", username=username, page_data={"username": username})
+
+@bp.route("/guest", methods=["POST"])
+def guest():
+    wait = services().admission.admit_request(None, request.remote_addr)
+    if wait:
+        return "Too many requests. Try again later.", 429, {"Retry-After": retry_after_header(wait)}
+    session.clear()
+    # guest için username gösterilmesini istersen session["username"]="Guest" ekle
+    return redirect(url_for('.root'))
+
+@bp.route("/register", methods=["GET", "POST"])
+def register():
+    if request.method == "POST":
+        username = request.form["username"]
+        email = request.form["email"]
+        if User.query.filter((User.username == username) | (User.email == email)).first():
+            return "Username or Email already taken."
+        try:
+            password = services().hasher.hash(request.form["password"])
+        except HasherBusy:
+            return "Server busy, please try again.", 503
+        user = User(username=username, email=email, password=password)
+        db.session.add(user)
+        # a guest who signs up keeps the conversation they just had, written as one batch
+        turns = services().guest_contexts.pop(session.pop("guest_id", None))
+        if turns:
+            db.session.flush()
+            db.session.execute(insert(Message), [
+                {"user_id": user.id, "role": role, "content": content, "tokens": count_tokens(content),
+                 "timestamp": datetime.utcfromtimestamp(at)}
+                for role, content, at in turns])
+        db.session.commit()
+        return redirect(url_for('.login'))
+    return render_template("register.html")
+
+@bp.route("/login", methods=["GET", "POST"])
+def login():
+    if request.method == "POST":
+        email = request.form["email"]
+        password = request.form["password"]
+        hasher, login_ip_failures, login_email_failures = (
+            services().hasher, services().login_ip_failures, services().login_email_failures)
+        # brute-force trafiği bcrypt'e hiç ulaşmadan reddet
+        if not login_ip_failures.allowed(request.remote_addr) or not login_email_failures.allowed(email):
+            return "Too many login attempts. Try again later.", 429
+        user = User.query.filter_by(email=email).first()
+        try:
+            valid = bool(user) and hasher.check(user.password, password)
+        except HasherBusy:
+            return "Server busy, please try again.", 503
+        if valid:
+            login_email_failures.reset(email)
+            if hasher.needs_rehash(user.password):
+                try:
+                    user.password = hasher.hash(password)
+                    db.session.commit()
+                except HasherBusy:
+                    pass  # bir sonraki girişte tekrar denenir
+            session["user_id"] = user.id
+            session["username"] = user.username
+            return redirect(url_for('.root'))
+        login_ip_failures.hit(request.remote_addr)
+        login_email_failures.hit(email)
+        return "Invalid credentials."
+    return render_template("login.html")
+
+@bp.route("/logout")
+def logout():
+    session.clear()
+    return redirect(url_for('.login'))
+
+def save_exchange(user_id, msg, reply, guest_id=None):
+    if not user_id:
+        if guest_id:
+            services().guest_contexts.add(guest_id, [("user", msg), ("assistant", reply)])
+        return
+    now = datetime.utcnow()
+    rows = [
+        {"user_id": user_id, "role": "user", "content": msg, "tokens": count_tokens(msg), "timestamp": now},
+        {"user_id": user_id, "role": "assistant", "content": reply, "tokens": count_tokens(reply), "timestamp": now},
+    ]
+    writer = message_writer()
+    if writer is not None and writer.add(rows):
+        return
+    # no writer, or its queue is full (the database is stuck or slow): write through instead
+    db.session.execute(insert(Message), rows)
+    db.session.commit()
+    schedule_memory(current_app._get_current_object(), user_id)
+    refresh_summary_safely(current_app._get_current_object(), user_id)
+
+def sse(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_reply(user_id, msg, history, bypass_cache=False, guest_id=None):
+    # OpenAI delta'larını geldikleri anda ilet; bağlantı kopsa bile elde edilen kısmı kaydet
+    parts = []
+    cache, router = services().cache, services().router
+    try:
+        cached = cache.get(MODEL, history, bypass=bypass_cache)
+        if cached is not None:
+            parts.append(cached)
+            yield sse({"delta": cached, "cached": True})
+        else:
+            key = cache.key(MODEL, history)
+            started = time.perf_counter()
+            for delta in services().inflight.stream(key, lambda: upstream_deltas(router, history)):
+                if not parts:
+                    add_stage("ttft", time.perf_counter() - started)
+                parts.append(delta)
+                yield sse({"delta": delta})
+            add_stage("upstream", time.perf_counter() - started)
+            cache.set(MODEL, history, "".join(parts))
+        yield sse({"done": True})
+    except Exception as e:
+        yield sse({"error": str(e)})
+    finally:
+        if parts:
+            save_exchange(user_id, msg, "".join(parts), guest_id)
+
+def wants_stream():
+    if request.json.get("stream"):
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"
+
+def rate_limited(wait):
+    response = jsonify({"error": "Too many messages. Try again later."})
+    response.status_code = 429
+    response.headers["Retry-After"] = retry_after_header(wait)
+    return response
+
+@bp.route("/chat", methods=["POST"])
+def chat():
+    user_id = session.get("user_id")
+    # cheap request-count check first so a flood is turned away before any DB work
+    wait = services().admission.admit_request(user_id, request.remote_addr)
+    if wait:
+        return rate_limited(wait)
+    msg = request.json.get("message", "")
+    guest_id = guest_session_id()
+    with stage("context"):
+        history = build_context(user_id, msg, guest_id)
+    wait = services().admission.admit_tokens(user_id, request.remote_addr, history_tokens(history))
+    if wait:
+        return rate_limited(wait)
+    bypass = cache_bypassed(request.json, request.headers.get("Cache-Control"))
+    if wants_stream():
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return Response(stream_with_context(stream_reply(user_id, msg, history, bypass, guest_id)),
+                        mimetype="text/event-stream", headers=headers)
+    with stage("upstream"):
+        reply, cached = complete(history, bypass)
+    with stage("persist"):
+        save_exchange(user_id, msg, reply, guest_id)
+    response = jsonify({"reply": reply})
+    response.headers["X-Cache"] = "HIT" if cached else "MISS"
+    return response
+
+@bp.route("/history")
+def history():
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify([])
+    sync_messages(user_id)
+    limit = request.args.get("limit", HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    before_id = request.args.get("before_id", type=int)
+    since_id = request.args.get("since_id", type=int)
+    query = Message.query.filter_by(user_id=user_id)
+    archived = []
+    if since_id is not None:
+        # newer than the cursor, oldest first; archived ids all precede the hot ones
+        archived = archived_page(user_id, limit, since_id=since_id)
+        messages = (query.filter(Message.id > since_id).order_by(Message.id).limit(limit - len(archived)).all()
+                    if len(archived) < limit else [])
+    else:
+        # latest page (or the page just before the cursor), returned oldest first
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        messages = query.order_by(Message.id.desc()).limit(limit).all()
+        messages.reverse()
+        if len(messages) < limit:
+            # scrolled past the hot range: continue in the archive blocks
+            archived = archived_page(user_id, limit - len(messages), messages[0].id if messages else before_id)
+    # timestamp ISO string for client formatting
+    return jsonify(archived + [{"id": m.id, "role": m.role, "content": m.content, "timestamp": m.timestamp.isoformat()}
+                               for m in messages])
+
+@bp.route("/export")
+def export():
+    user_id = session.get("user_id")
+    if not user_id:
+        return "Login required.", 401
+    sync_messages(user_id)
+    headers = {"Content-Disposition": 'attachment; filename="syrixrm-history.ndjson.gz"'}
+    return Response(stream_with_context(gzip_chunks(message_lines(user_id))),
+                    mimetype="application/gzip", headers=headers)
+
+@bp.route("/import", methods=["POST"])
+def import_history():
+    # body is an /export file (gzip'd or plain NDJSON), e.g. curl --data-binary @syrixrm-history.ndjson.gz
+    user_id = session.get("user_id")
+    if not user_id:
+        return "Login required.", 401
+    try:
+        _, imported = import_messages(open_export(request.stream), user_id)
+    except InvalidExport as e:
+        return jsonify({"error": str(e)}), 400
+    schedule_memory(current_app._get_current_object(), user_id)
+    refresh_summary_safely(current_app._get_current_object(), user_id)
+    return jsonify({"imported": imported})
+
+@bp.route("/search")
+def search():
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"results": [], "next_offset": None})
+    state = current_app.extensions["syrixrm"]
+    if not state.search_ready:
+        with db.engine.connect() as conn:
+            state.search_ready = db.engine.dialect.name == "sqlite" and search_index_exists(conn)
+        if not state.search_ready:
+            return "Search is not available.", 501
+    sync_messages(user_id)
+    limit = request.args.get("limit", SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    rows = search_messages(user_id, request.args.get("q", ""), limit + 1, offset)
+    # snippet is HTML: the message text is escaped and only the <mark> tags are markup
+    results = [{"id": r.id, "role": r.role, "snippet": highlight(r.snippet),
+                "timestamp": r.timestamp.isoformat()}
+               for r in rows[:limit]]
+    return jsonify({"results": results, "next_offset": offset + limit if len(rows) > limit else None})
+
+# === APP FACTORY ===
+_apps = []
+
+def create_app(config=None):
+    """Build a configured app; config overrides the SYRIXRM_*/env defaults from default_config()."""
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    CORS(app)
+    bcrypt.init_app(app)
+    db.init_app(app)
+    config = app.config
+    if config["SYRIXRM_PROXY_HOPS"]:
+        # behind a proxy every request comes from the proxy; remote_addr becomes the client it forwarded for
+        hops = config["SYRIXRM_PROXY_HOPS"]
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+    assets = load_assets(app.static_folder)
+    memory = None
+    if config["SYRIXRM_MEMORY"]:
+        if np is None:
+            log.warning("semantic memory needs numpy; SYRIXRM_MEMORY is ignored")
+        else:
+            folder = config["SYRIXRM_MEMORY_DIR"] or os.path.join(app.instance_path, "memory")
+            memory = MemoryIndex(folder, make_embedder(config["SYRIXRM_EMBEDDER"], config["SYRIXRM_FAKE_LLM"]))
+    state = make_state(config["SYRIXRM_STATE_URL"])
+    clients = UpstreamClients(config["OPENAI_API_KEY"], config["SYRIXRM_FAKE_LLM"])
+    # everything with settings lives here rather than in module globals, so two apps never share it
+    app.extensions["syrixrm"] = SimpleNamespace(
+        writer=MessageWriter(app, WRITE_BATCH_SIZE, WRITE_INTERVAL) if config["SYRIXRM_WRITE_BEHIND"] else None,
+        assets=assets,
+        assets_by_url={asset.url_name: asset for asset in assets.values()},
+        search_ready=False,
+        memory=memory,
+        state=state,
+        clients=clients,
+        router=make_router(config, clients),
+        inflight=SingleFlight(),
+        cache=CompletionCache(make_cache_backend(config, state), config["SYRIXRM_CACHE_TTL"]),
+        admission=make_admission(config, state),
+        hasher=PasswordHasher(config["SYRIXRM_PASSWORD_WORKERS"], config["SYRIXRM_PASSWORD_QUEUE"]),
+        login_ip_failures=AttemptLimiter(state, "login-ip", config["SYRIXRM_LOGIN_IP_LIMIT"],
+                                         config["SYRIXRM_LOGIN_IP_WINDOW"]),
+        login_email_failures=AttemptLimiter(state, "login-email", config["SYRIXRM_LOGIN_EMAIL_LIMIT"],
+                                            config["SYRIXRM_LOGIN_EMAIL_WINDOW"]),
+        guest_contexts=GuestContextStore(config["SYRIXRM_GUEST_CONTEXT_BYTES"], config["SYRIXRM_GUEST_CONTEXT_TURNS"],
+                                         config["SYRIXRM_GUEST_CONTEXT_TTL"], config["SYRIXRM_GUEST_CONTEXT_GUEST_BYTES"]),
+    )
+    if config["SYRIXRM_SERVER_SESSIONS"]:
+        if not state.shared:
+            log.warning("server-side sessions in memory:// state are lost between workers; set SYRIXRM_STATE_URL")
+        app.session_interface = StateSessionInterface(state)
+    app.register_blueprint(bp)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(search_backfill_command)
+    app.cli.add_command(backup_command)
+    app.cli.add_command(restore_command)
+    app.cli.add_command(compact_command)
+    app.cli.add_command(memory_backfill_command)
+    # şablonları açılışta bir kez derle; Jinja her istekte önbellekteki sürümü kullanır
+    for template_name in ("login.html", "register.html", "chat.html"):
+        app.jinja_env.get_template(template_name)
+    _apps.append(app)
+    return app
+
+def dispose_engines():
+    # a --preload parent that touched the database must not hand its pooled connections to workers
+    for app in _apps:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=dispose_engines)
+
+def __getattr__(name):
+    # `app:app` (gunicorn, flask --app app, asgi.py) is built on first access, not at import
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        upgrade_schema()
+    app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,565 @@
+"""ASGI entrypoint: /chat runs natively on AsyncOpenAI, everything else is the Flask app.
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:application
+
+Client addresses follow SYRIXRM_PROXY_HOPS here too, for /chat as well as the
+Flask routes. uvicorn has its own proxy-header handling, which only trusts
+127.0.0.1; behind Heroku's router, also pass --forwarded-allow-ips='*'
+(FORWARDED_ALLOW_IPS for the gunicorn worker) so its access log and scheme
+show the real client.
+
+Upstream completions no longer pin a worker: each worker's event loop keeps
+up to SYRIXRM_UPSTREAM_CONCURRENCY calls in flight and parks at most
+SYRIXRM_UPSTREAM_QUEUE more. Beyond that /chat answers 503 with Retry-After.
+Registered users are served from the queue before guests.
+The other routes run on asgiref's thread pool and stay responsive meanwhile.
+"""
+import asyncio
+import collections
+import json
+import os
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import session
+from openai import AsyncOpenAI
+from werkzeug.test import EnvironBuilder
+
+import app as syrix
+
+UPSTREAM_CONCURRENCY = int(os.getenv("SYRIXRM_UPSTREAM_CONCURRENCY", "64"))
+UPSTREAM_QUEUE = int(os.getenv("SYRIXRM_UPSTREAM_QUEUE", "256"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("SYRIXRM_UPSTREAM_QUEUE_TIMEOUT", "30"))
+# guests may fill only this much of the queue, so registered users always find a place
+UPSTREAM_GUEST_QUEUE = int(os.getenv("SYRIXRM_UPSTREAM_GUEST_QUEUE", str(UPSTREAM_QUEUE // 4)))
+RETRY_AFTER = os.getenv("SYRIXRM_RETRY_AFTER", "2")
+
+
+class UpstreamSaturated(Exception):
+    pass
+
+
+class UpstreamLimiter:
+    """Caps in-flight upstream calls; callers beyond the cap wait in a bounded queue.
+
+    Registered users wait in a priority lane that is always served before the guest
+    lane, and guests may hold at most guest_queue of the queue's places.
+    """
+
+    def __init__(self, limit, queue_size, queue_timeout, guest_queue):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.guest_queue = guest_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._lanes = {True: collections.deque(), False: collections.deque()}
+
+    @property
+    def waiting(self):
+        return len(self._lanes[True]) + len(self._lanes[False])
+
+    async def acquire(self, priority=False):
+        if self.in_flight < self.limit and not self.waiting:
+            self.in_flight += 1
+            return
+        lane = self._lanes[priority]
+        if self.waiting >= self.queue_size or (not priority and len(lane) >= self.guest_queue):
+            self.rejected += 1
+            raise UpstreamSaturated()
+        waiter = asyncio.get_running_loop().create_future()
+        lane.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we gave up; pass it on
+                self.release()
+            elif waiter in lane:
+                lane.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise UpstreamSaturated()
+            raise
+
+    def release(self):
+        # hand the slot straight to the next waiter, registered users first
+        for lane in (self._lanes[True], self._lanes[False]):
+            while lane:
+                waiter = lane.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+
+class AsyncUpstreamClients:
+    """asyncio twin of app.UpstreamClients, configured from the same app's settings."""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self._clients = {}
+        self._pid = None
+
+    def get(self, base_url=None, api_key=None):
+        # one client per endpoint and worker process so connection pools are reused across requests
+        if self._pid != os.getpid():
+            self._clients.clear()
+            self._pid = os.getpid()
+        client = self._clients.get(base_url)
+        if client is None:
+            if self.clients.fake:
+                client = syrix.AsyncFakeCompletionClient(self.clients.get(base_url, api_key))
+            else:
+                client = AsyncOpenAI(api_key=api_key or self.clients.api_key, base_url=base_url, max_retries=0)
+            self._clients[base_url] = client
+        return client
+
+
+async def close_stream(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        await close()
+
+
+class AsyncUpstreamRouter:
+    """asyncio twin of app.UpstreamRouter, sharing its routes, health records and latency trackers.
+
+    Attempts are bounded with wait_for, and a losing hedged attempt is cancelled outright.
+    """
+
+    def __init__(self, policy, clients):
+        self.policy = policy
+        self.clients = clients
+
+    async def _run(self, attempt):
+        policy = self.policy
+        deadline = time.monotonic() + policy.timeout
+        error = None
+        for route in policy.ordered_routes():
+            for n in range(policy.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise error or syrix.UpstreamTimeout()
+                timeout = min(remaining, policy.attempt_timeout)
+                try:
+                    return await asyncio.wait_for(attempt(route, timeout), timeout)
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        route.health.record(False, timeout)
+                        syrix.UPSTREAM_ATTEMPTS.labels(route.name, "timeout").inc()
+                        e = syrix.UpstreamTimeout(f"no answer from {route.name} within {timeout:.1f}s")
+                    if not syrix.retryable(e):
+                        raise
+                    error = e
+                    syrix.log.warning("upstream %s attempt %d failed: %s", route.name, n + 1, e)
+                if n < policy.retries:
+                    await asyncio.sleep(min(syrix.backoff(n), max(0.0, deadline - time.monotonic())))
+        raise error or syrix.UpstreamTimeout()
+
+    async def _timed(self, route, kind, call):
+        started = time.perf_counter()
+        try:
+            result = await call()
+        except Exception:
+            route.health.record(False, time.perf_counter() - started)
+            syrix.UPSTREAM_ATTEMPTS.labels(route.name, "error").inc()
+            raise
+        elapsed = time.perf_counter() - started
+        route.health.record(True, elapsed)
+        self.policy.latency[kind].add(elapsed)
+        syrix.UPSTREAM_ATTEMPTS.labels(route.name, "ok").inc()
+        return result
+
+    async def _hedged(self, kind, call, discard=None):
+        if not self.policy.hedge:
+            return await call()
+        tasks = [asyncio.ensure_future(call())]
+        done, _ = await asyncio.wait(tasks, timeout=self.policy.hedge_delay(kind))
+        if not done:
+            syrix.UPSTREAM_HEDGES.labels("launched").inc()
+            tasks.append(asyncio.ensure_future(call()))
+        winner = None
+        error = None
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and winner is None:
+                        winner = task
+                    elif task.exception() is not None:
+                        error = task.exception()
+            if winner is None:
+                raise error
+            if winner is not tasks[0]:
+                syrix.UPSTREAM_HEDGES.labels("won").inc()
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+    async def complete(self, messages, **kwargs):
+        async def attempt(route, timeout):
+            async def call():
+                return await self.clients.get(route.base_url, route.api_key).chat.completions.create(
+                    model=route.model, messages=messages, timeout=timeout, **kwargs)
+            return await self._hedged("complete", lambda: self._timed(route, "complete", call))
+        return await self._run(attempt)
+
+    async def _open(self, route, messages, timeout, kwargs):
+        # opened once the first text arrives, so a stalled stream can still be retried or hedged
+        stream = await self.clients.get(route.base_url, route.api_key).chat.completions.create(
+            model=route.model, messages=messages, stream=True, timeout=timeout, **kwargs)
+        chunks = []
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                chunk = await iterator.__anext__()
+                chunks.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except StopAsyncIteration:
+            pass
+        except BaseException:
+            await close_stream(stream)
+            raise
+        return stream, iterator, chunks
+
+    async def stream(self, messages, **kwargs):
+        async def attempt(route, timeout):
+            return await self._hedged(
+                "stream", lambda: self._timed(route, "stream", lambda: self._open(route, messages, timeout, kwargs)),
+                discard=lambda opened: close_stream(opened[0]))
+        stream, iterator, chunks = await self._run(attempt)
+        try:
+            for chunk in chunks:
+                yield chunk
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            await close_stream(stream)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def wants_stream(scope, payload):
+    if payload.get("stream"):
+        return True
+    accept = dict(scope["headers"]).get(b"accept", b"")
+    return accept.startswith(b"text/event-stream")
+
+
+def cache_control(scope):
+    return dict(scope["headers"]).get(b"cache-control", b"").decode("latin-1")
+
+
+def client_address(scope, hops):
+    """The client's IP as app.py's ProxyFix resolves it: the hops-th X-Forwarded-For entry from the right."""
+    peer = scope["client"][0] if scope.get("client") else None
+    if not hops:
+        return peer
+    forwarded = [value.strip() for value in
+                 dict(scope["headers"]).get(b"x-forwarded-for", b"").decode("latin-1").split(",")]
+    # too few entries means the header didn't come through all the proxies; keep the peer then
+    return forwarded[-hops] if len(forwarded) >= hops and forwarded[-hops] else peer
+
+
+class AsyncStreamFlight:
+    """asyncio twin of app.StreamFlight."""
+
+    def __init__(self):
+        self.deltas = []
+        self.finished = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def pump(self, source):
+        try:
+            async for delta in source:
+                async with self._changed:
+                    self.deltas.append(delta)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    async def started(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.deltas or self.finished)
+
+    async def follow(self):
+        i = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: i < len(self.deltas) or self.finished)
+                new = self.deltas[i:]
+                finished = self.finished
+            for delta in new:
+                yield delta
+            i += len(new)
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class AsyncSingleFlight:
+    """asyncio twin of app.SingleFlight: identical in-flight prompts share one upstream call."""
+
+    def __init__(self):
+        self.deduplicated = 0
+        self._calls = {}
+        self._streams = {}
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.deduplicated += 1
+            syrix.DEDUPLICATED.inc()
+        # shielded so one waiter disconnecting doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def stream(self, key, start):
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = self._streams[key] = AsyncStreamFlight()
+            flight.task = asyncio.ensure_future(flight.pump(start()))
+            flight.task.add_done_callback(lambda _: self._streams.pop(key, None))
+        else:
+            self.deduplicated += 1
+            syrix.DEDUPLICATED.inc()
+        return flight
+
+
+def busy_response(send):
+    return send_json(send, 503, {"error": "Sunucu meşgul, lütfen tekrar deneyin."},
+                     [(b"retry-after", RETRY_AFTER.encode())])
+
+
+def rate_limited(send, wait):
+    return send_json(send, 429, {"error": "Too many messages. Try again later."},
+                     [(b"retry-after", syrix.retry_after_header(wait).encode())])
+
+
+class ChatDispatcher:
+    """Serves POST /chat natively and hands every other request to the Flask app.
+
+    Upstream clients, the limiter and single-flight are per dispatcher, and the state,
+    caches and admission buckets are the wrapped app's own (app.extensions["syrixrm"]).
+    """
+
+    def __init__(self, flask_app, limiter=None):
+        self.app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.services = flask_app.extensions["syrixrm"]
+        self.router = AsyncUpstreamRouter(self.services.router, AsyncUpstreamClients(self.services.clients))
+        self.limiter = limiter or UpstreamLimiter(UPSTREAM_CONCURRENCY, UPSTREAM_QUEUE, UPSTREAM_QUEUE_TIMEOUT,
+                                                  UPSTREAM_GUEST_QUEUE)
+        self.inflight = AsyncSingleFlight()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/chat" and scope["method"] == "POST":
+            return await self.timed_chat(scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def timed_chat(self, scope, receive, send):
+        # Flask's before/after_request hooks don't see this route, so time it here
+        started = time.perf_counter()
+        status = 500
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.chat(scope, receive, send_and_record)
+        finally:
+            syrix.REQUEST_LATENCY.labels("/chat", "POST", str(status)).observe(time.perf_counter() - started)
+
+    def in_app(self, fn, *args):
+        with self.app.app_context():
+            return fn(*args)
+
+    def session_identity(self, scope):
+        # the guest token is issued by the Flask routes (/ sets it), so this side only reads it;
+        # open_session goes through app.session_interface, so server-side sessions work the same
+        headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+        environ = EnvironBuilder(path=scope["path"], method=scope["method"], headers=headers).get_environ()
+        with self.app.request_context(environ):
+            user_id = session.get("user_id")
+            return user_id, None if user_id else session.get("guest_id")
+
+    async def shared_flight(self, key, start):
+        """asyncio twin of app.shared_flight: one upstream call per prompt across processes."""
+        state, cache = self.services.state, self.services.cache
+        # other processes can only see the reply if the cache itself is shared, not just the claim
+        if not state.shared or not getattr(cache.backend, "shared", False):
+            return await start()
+        claim = "flight:" + key
+        deadline = time.monotonic() + self.router.policy.timeout
+        delay = 0.02
+        while True:
+            try:
+                if await asyncio.to_thread(state.add, claim, b"1", self.router.policy.timeout):
+                    break
+            except Exception as e:
+                syrix.log.warning("single-flight claim failed: %s", e)
+                return await start()
+            reply = await asyncio.to_thread(cache.lookup, key)
+            if reply is not None:
+                syrix.DEDUPLICATED.inc()
+                return reply
+            if time.monotonic() > deadline:
+                return await start()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, syrix.FLIGHT_POLL_MAX)
+        try:
+            reply = await asyncio.to_thread(cache.lookup, key)
+            if reply is not None:
+                syrix.DEDUPLICATED.inc()
+                return reply
+            return await start()
+        finally:
+            try:
+                await asyncio.to_thread(state.delete, claim)
+            except Exception:
+                pass  # the claim expires on its own
+
+    async def upstream_complete(self, history, priority=False):
+        await self.limiter.acquire(priority)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self.router.complete(history)
+            outcome = "ok"
+        finally:
+            self.limiter.release()
+            syrix.UPSTREAM_LATENCY.labels("complete", outcome).observe(time.perf_counter() - started)
+        syrix.record_usage("chat", getattr(response, "usage", None))
+        reply = response.choices[0].message.content
+        await asyncio.to_thread(self.services.cache.set, syrix.MODEL, history, reply)
+        return reply
+
+    async def upstream_deltas(self, history, priority=False):
+        await self.limiter.acquire(priority)
+        started = time.perf_counter()
+        first = None
+        outcome = "error"
+        try:
+            async for chunk in self.router.stream(history, stream_options={"include_usage": True}):
+                syrix.record_usage("chat", getattr(chunk, "usage", None))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first is None:
+                        first = time.perf_counter()
+                        syrix.UPSTREAM_TTFT.observe(first - started)
+                    yield chunk.choices[0].delta.content
+            outcome = "ok"
+        finally:
+            self.limiter.release()
+            syrix.UPSTREAM_LATENCY.labels("stream", outcome).observe(time.perf_counter() - started)
+
+    async def stream_chat(self, send, user_id, guest_id, msg, history, cached=None):
+        flight = None
+        if cached is None:
+            key = self.services.cache.key(syrix.MODEL, history)
+            flight = self.inflight.stream(key, lambda: self.upstream_deltas(history, bool(user_id)))
+            # hold the headers until upstream admits us, so saturation can still be a plain 503
+            await flight.started()
+            if not flight.deltas and isinstance(flight.error, UpstreamSaturated):
+                return await busy_response(send)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+        parts = []
+        try:
+            if cached is not None:
+                parts.append(cached)
+                await send({"type": "http.response.body", "more_body": True,
+                            "body": syrix.sse({"delta": cached, "cached": True}).encode("utf-8")})
+            else:
+                async for delta in flight.follow():
+                    parts.append(delta)
+                    await send({"type": "http.response.body", "body": syrix.sse({"delta": delta}).encode("utf-8"),
+                                "more_body": True})
+                await asyncio.to_thread(self.services.cache.set, syrix.MODEL, history, "".join(parts))
+            await send({"type": "http.response.body", "body": syrix.sse({"done": True}).encode("utf-8")})
+        except Exception as e:
+            await send({"type": "http.response.body", "body": syrix.sse({"error": str(e)}).encode("utf-8")})
+        finally:
+            if parts:
+                await asyncio.to_thread(self.in_app, syrix.save_exchange, user_id, msg, "".join(parts), guest_id)
+
+    async def chat(self, scope, receive, send):
+        try:
+            payload = json.loads(await read_body(receive) or b"{}")
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            # the Flask route answers a bad body with 400 as well
+            return await send_json(send, 400, {"error": "Invalid JSON body."})
+        msg = payload.get("message", "")
+        # server-side sessions are a state-store round trip, so keep them off the loop
+        user_id, guest_id = await asyncio.to_thread(self.session_identity, scope)
+        ip = client_address(scope, self.app.config["SYRIXRM_PROXY_HOPS"])
+        wait = await asyncio.to_thread(self.services.admission.admit_request, user_id, ip)
+        if wait:
+            return await rate_limited(send, wait)
+        history = await asyncio.to_thread(self.in_app, syrix.build_context, user_id, msg, guest_id)
+        wait = await asyncio.to_thread(self.services.admission.admit_tokens, user_id, ip,
+                                       syrix.history_tokens(history))
+        if wait:
+            return await rate_limited(send, wait)
+        bypass = syrix.cache_bypassed(payload, cache_control(scope))
+        cached = await asyncio.to_thread(self.services.cache.get, syrix.MODEL, history, bypass)
+        if wants_stream(scope, payload):
+            return await self.stream_chat(send, user_id, guest_id, msg, history, cached)
+        reply = cached
+        if reply is None:
+            # cache hits never touch upstream, so only misses go through the limiter
+            key = self.services.cache.key(syrix.MODEL, history)
+            try:
+                def start():
+                    return self.upstream_complete(history, bool(user_id))
+                reply = await self.inflight.do(key, start if bypass else lambda: self.shared_flight(key, start))
+            except UpstreamSaturated:
+                return await busy_response(send)
+        await asyncio.to_thread(self.in_app, syrix.save_exchange, user_id, msg, reply, guest_id)
+        await send_json(send, 200, {"reply": reply}, [(b"x-cache", b"HIT" if cached is not None else b"MISS")])
+
+
+def __getattr__(name):
+    # built on first access like app.app, so importing this module stays free of I/O
+    global application
+    if name == "application":
+        application = ChatDispatcher(syrix.app)
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
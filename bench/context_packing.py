@@ -0,0 +1,74 @@
+"""Offline benchmark for the token-budgeted context builder.
+
+Runs against a throwaway SQLite file and the fake completion client, so no
+API key is needed:
+
+    python bench/context_packing.py --messages 2000 --budget 3000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--budget", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syrixrm-bench-")
+    os.environ["SYRIXRM_FAKE_LLM"] = "1"
+    os.environ["SYRIXRM_CONTEXT_TOKENS"] = str(args.budget)
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    import app as syrix
+
+    rng = random.Random(args.seed)
+    words = "merhaba model token özet bağlam cevap soru hızlı uzun kısa veri".split()
+    with syrix.app.app_context():
+        syrix.upgrade_schema()
+        user = syrix.User(username="bench", email="bench@example.com", password="x")
+        syrix.db.session.add(user)
+        syrix.db.session.commit()
+        for i in range(args.messages):
+            # mostly short turns with the occasional very long one
+            length = rng.choice([5, 10, 20, 40, 800]) if i % 2 else rng.choice([3, 8, 15])
+            content = " ".join(rng.choice(words) for _ in range(length))
+            role = "assistant" if i % 2 else "user"
+            syrix.db.session.add(syrix.Message(user_id=user.id, role=role, content=content,
+                                               tokens=syrix.count_tokens(content)))
+        syrix.db.session.commit()
+
+        def naive(msg):
+            rows = (syrix.Message.query.filter_by(user_id=user.id)
+                    .order_by(syrix.Message.id.desc()).limit(12).all())
+            history = [{"role": "system", "content": syrix.SYSTEM_PROMPT}]
+            history += [{"role": m.role, "content": m.content} for m in reversed(rows)]
+            history.append({"role": "user", "content": msg})
+            return history
+
+        t0 = time.perf_counter()
+        syrix.refresh_summary(user.id)
+        summary_ms = (time.perf_counter() - t0) * 1000
+
+        for name, builder in (("last-12", naive), ("packed", lambda msg: syrix.build_context(user.id, msg))):
+            tokens = []
+            t0 = time.perf_counter()
+            for _ in range(args.rounds):
+                history = builder("yeni soru")
+                tokens.append(sum(syrix.count_tokens(m["content"]) for m in history))
+            elapsed = (time.perf_counter() - t0) * 1000 / args.rounds
+            print(f"{name:8s} build={elapsed:.2f}ms  prompt_tokens avg={sum(tokens) / len(tokens):.0f} "
+                  f"max={max(tokens)}  messages={len(history)}")
+        print(f"summary refresh: {summary_ms:.1f}ms, fake upstream calls={syrix.llm_client().calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Local stand-in for the OpenAI chat-completions API.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8099/v1 and any
+OPENAI_API_KEY. Both plain and streamed (SSE) completions are supported:
+
+    python bench/fake_openai.py --port 8099 --latency 0.3 --tokens-per-sec 80
+
+Faults can be injected to exercise retries, hedging and fallback; --fault-models
+limits them to the named models so a fallback model stays healthy:
+
+    python bench/fake_openai.py --stall-rate 0.05 --stall-seconds 8 --error-rate 0.02 --fault-models gpt-4o-mini
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "SyrixRM yanıt veriyor ve bu metin yük testi için üretilen sahte bir cevaptır".split()
+
+
+class FakeConfig:
+    def __init__(self, latency=0.3, tokens_per_sec=80.0, reply_tokens=60, stall_rate=0.0, stall_seconds=10.0,
+                 error_rate=0.0, error_status=503, fault_models=None):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fault_models = set(fault_models or ())
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.stalls = 0
+        self.errors = 0
+
+    def fault(self, model):
+        """Pick "error", "stall" or None for one request."""
+        if self.fault_models and model not in self.fault_models:
+            return None
+        roll = random.random()
+        kind = "error" if roll < self.error_rate else "stall" if roll < self.error_rate + self.stall_rate else None
+        if kind:
+            with self.lock:
+                if kind == "error":
+                    self.errors += 1
+                else:
+                    self.stalls += 1
+        return kind
+
+    def reply_words(self, messages):
+        prompt = messages[-1]["content"] if messages else ""
+        # deterministic per prompt so cache/dedup behave the same as with a real model
+        rng = random.Random(prompt)
+        return [rng.choice(WORDS) + " " for _ in range(self.reply_tokens)]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.server.config
+        with config.lock:
+            config.requests += 1
+        model = body.get("model", "gpt-4o-mini")
+        words = config.reply_words(body.get("messages", []))
+        if body.get("max_tokens"):
+            words = words[:body["max_tokens"]]
+        prompt_tokens = sum(len(m.get("content") or "") // 4 for m in body.get("messages", []))
+        completion_id = "chatcmpl-" + uuid.uuid4().hex[:24]
+        created = int(time.time())
+        fault = config.fault(model)
+        if fault == "error":
+            return self._json(config.error_status, {"error": {"message": "injected fault", "type": "server_error"}})
+        time.sleep(config.latency + (config.stall_seconds if fault == "stall" else 0))
+
+        if not body.get("stream"):
+            time.sleep(len(words) / config.tokens_per_sec)
+            return self._json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                          "total_tokens": prompt_tokens + len(words)},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": w} for w in words] + [{}]
+        for i, delta in enumerate(deltas):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta,
+                                  "finish_reason": "stop" if i == len(deltas) - 1 else None}]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            if "content" in delta and delta["content"]:
+                time.sleep(1 / config.tokens_per_sec)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                                              "total_tokens": prompt_tokens + len(words)}}
+            self._chunk(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+
+    def handle_error(self, request, client_address):
+        # clients dropping pooled keep-alive connections is expected, not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(host="127.0.0.1", port=0, config=None):
+    """Start the stub on a background thread; returns the server (see .server_port)."""
+    server = FakeOpenAIServer((host, port), config or FakeConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of requests held back --stall-seconds")
+    parser.add_argument("--stall-seconds", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--fault-models", nargs="*", help="only inject faults for these models")
+    args = parser.parse_args()
+    config = FakeConfig(args.latency, args.tokens_per_sec, args.reply_tokens, args.stall_rate, args.stall_seconds,
+                        args.error_rate, args.error_status, args.fault_models)
+    server = FakeOpenAIServer((args.host, args.port), config)
+    print(f"fake OpenAI listening on http://{args.host}:{server.server_port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Local stand-in for a Redis server, enough for SYRIXRM_STATE_URL=redis://.
+
+Speaks RESP2 (RESP3 after HELLO 3, which redis-py 5+ sends) and keeps everything
+in one process's memory. It covers the commands the app's RedisState uses (GET/SET
+with EX/PX/NX/XX, DEL, INCR/INCRBY, EXPIRE, pipelines via MULTI/EXEC) and the app's token-bucket script; it can't run Lua, so EVAL/EVALSHA
+recognise that script by its first line and run a Python version of it:
+
+    python bench/fake_redis.py --port 6399
+    SYRIXRM_STATE_URL=redis://127.0.0.1:6399/0 gunicorn -w 4 app:app
+"""
+import argparse
+import hashlib
+import socketserver
+import threading
+import time
+
+TOKEN_BUCKET = "-- syrixrm: token bucket"
+
+
+class Error(Exception):
+    pass
+
+
+class FakeStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+        self.scripts = {}
+        self.commands = 0
+
+    def _live(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _expire(self, key, seconds):
+        if seconds is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.time() + seconds
+
+    def run(self, args):
+        """Run one command (list of bytes); returns the reply or raises Error."""
+        with self.lock:
+            self.commands += 1
+            name = args[0].decode().upper()
+            handler = getattr(self, "cmd_" + name.lower(), None)
+            if handler is None:
+                raise Error(f"ERR unknown command '{name}'")
+            return handler(*args[1:])
+
+    def cmd_ping(self, *args):
+        return args[0] if args else "+PONG"
+
+    def cmd_client(self, *args):
+        return "+OK"
+
+    def cmd_select(self, db):
+        return "+OK"
+
+    def cmd_get(self, key):
+        value = self._live(key)
+        if isinstance(value, dict):
+            raise Error("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def cmd_set(self, key, value, *options):
+        flags, ttl, rest = set(), None, list(options)
+        while rest:
+            option = rest.pop(0).decode().upper()
+            if option == "EX":
+                ttl = float(rest.pop(0))
+            elif option == "PX":
+                ttl = float(rest.pop(0)) / 1000
+            else:
+                flags.add(option)
+        exists = self._live(key) is not None
+        if ("NX" in flags and exists) or ("XX" in flags and not exists):
+            return None
+        self.data[key] = value
+        self._expire(key, ttl)
+        return "+OK"
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += self._live(key) is not None
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_incrby(self, key, amount):
+        try:
+            value = int(self._live(key) or 0) + int(amount)
+        except (TypeError, ValueError):
+            raise Error("ERR value is not an integer or out of range")
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, b"1")
+
+    def cmd_expire(self, key, seconds):
+        if self._live(key) is None:
+            return 0
+        self._expire(key, float(seconds))
+        return 1
+
+    def cmd_pexpire(self, key, milliseconds):
+        return self.cmd_expire(key, float(milliseconds) / 1000)
+
+    def cmd_ttl(self, key):
+        if self._live(key) is None:
+            return -2
+        deadline = self.expires.get(key)
+        return -1 if deadline is None else int(deadline - time.time() + 0.5)
+
+    def cmd_time(self):
+        now = time.time()
+        return [str(int(now)).encode(), str(int(now % 1 * 1000000)).encode()]
+
+    def cmd_dbsize(self):
+        return sum(1 for key in list(self.data) if self._live(key) is not None)
+
+    def cmd_flushall(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return "+OK"
+
+    def cmd_script(self, subcommand, *args):
+        subcommand = subcommand.decode().upper()
+        if subcommand == "LOAD":
+            sha = hashlib.sha1(args[0]).hexdigest()
+            self.scripts[sha] = args[0]
+            return sha.encode()
+        if subcommand == "EXISTS":
+            return [int(sha.decode() in self.scripts) for sha in args]
+        if subcommand == "FLUSH":
+            self.scripts.clear()
+            return "+OK"
+        raise Error(f"ERR unknown SCRIPT subcommand '{subcommand}'")
+
+    def cmd_eval(self, script, numkeys, *args):
+        self.scripts[hashlib.sha1(script).hexdigest()] = script
+        return self._script(script, int(numkeys), args)
+
+    def cmd_evalsha(self, sha, numkeys, *args):
+        script = self.scripts.get(sha.decode())
+        if script is None:
+            raise Error("NOSCRIPT No matching script. Please use EVAL.")
+        return self._script(script, int(numkeys), args)
+
+    def _script(self, script, numkeys, args):
+        if not script.lstrip().startswith(TOKEN_BUCKET.encode()):
+            raise Error("ERR fake_redis only runs the syrixrm token-bucket script")
+        key = args[0]
+        capacity, rate, cost = (float(a) for a in args[numkeys:numkeys + 3])
+        now = time.time()
+        state = self._live(key) or {}
+        tokens = min(capacity, state.get("tokens", capacity) + (now - state.get("updated", now)) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self.data[key] = {"tokens": tokens, "updated": now}
+        self._expire(key, -(-capacity // rate) + 1)
+        return str(wait).encode()
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # inline command, as typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def encode(self, reply):
+        if reply is None:
+            return b"_\r\n" if self.protocol == 3 else b"$-1\r\n"
+        if isinstance(reply, dict):
+            return b"%%%d\r\n" % len(reply) + b"".join(self.encode(k) + self.encode(v) for k, v in reply.items())
+        if isinstance(reply, Error):
+            return b"-" + str(reply).encode() + b"\r\n"
+        if isinstance(reply, str):
+            return reply.encode() + b"\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self.encode(r) for r in reply)
+        return b"$%d\r\n" % len(reply) + reply + b"\r\n"
+
+    def handle(self):
+        store = self.server.store
+        queued = None
+        self.protocol = 2
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            name = args[0].decode().upper()
+            if name == "QUIT":
+                self.wfile.write(b"+OK\r\n")
+                return
+            if name == "HELLO":
+                version = int(args[1]) if len(args) > 1 else self.protocol
+                if version not in (2, 3):
+                    reply = Error("NOPROTO unsupported protocol version")
+                else:
+                    self.protocol = version
+                    info = {b"server": b"redis", b"version": b"7.0.0", b"proto": version, b"mode": b"standalone"}
+                    # RESP2 has no maps; HELLO 2 answers with a flat list instead
+                    reply = info if version == 3 else [x for item in info.items() for x in item]
+            elif name == "MULTI":
+                queued, reply = [], "+OK"
+            elif name == "EXEC" and queued is not None:
+                # the store lock is per command, so a transaction is only atomic per command;
+                # fine for the SET NX + INCR pipelines RedisState sends
+                reply = []
+                for command in queued:
+                    try:
+                        reply.append(store.run(command))
+                    except Error as e:
+                        reply.append(e)
+                queued = None
+            elif name == "DISCARD" and queued is not None:
+                queued, reply = None, "+OK"
+            elif queued is not None:
+                queued.append(args)
+                reply = "+QUEUED"
+            else:
+                try:
+                    reply = store.run(args)
+                except Error as e:
+                    reply = e
+            self.wfile.write(self.encode(reply))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store=None):
+        super().__init__(address, FakeRedisHandler)
+        self.store = store or FakeStore()
+
+    @property
+    def server_port(self):
+        return self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def serve(host="127.0.0.1", port=0):
+    """Start the stand-in on a background thread; returns the server (see .server_port)."""
+    server = FakeRedisServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    server = FakeRedisServer((args.host, args.port))
+    print(f"fake Redis listening on redis://{args.host}:{server.server_port}/0")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Offline load test: real gunicorn + the fake OpenAI stub, scripted route mix.
+
+    python bench/loadtest.py --duration 30 --users 50 --workers 4
+    python bench/loadtest.py --worker-class uvicorn.workers.UvicornWorker --compare bench/results/<old>.json
+    python bench/loadtest.py --stall-rate 0.05 --stall-seconds 8 --hedge 1 --fallback-model gpt-4o
+    python bench/loadtest.py --state fake-redis --server-sessions
+
+Prints RPS and p50/p95/p99 per route and writes the run to bench/results/
+as JSON (tagged with the git commit) so runs can be compared across commits.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import fake_openai  # noqa: E402
+import fake_redis  # noqa: E402
+
+DEFAULT_MIX = "root=3,history=6,chat=4,chat_stream=2,login=1,register=1"
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class VirtualUser:
+    def __init__(self, base, index):
+        self.base = base
+        # each virtual user gets its own address, as the app sees it behind one proxy hop
+        self.address = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+        self.email = f"load{index}-{random.getrandbits(32)}@example.com"
+        self.username = self.email.split("@")[0]
+        self.opener = urllib.request.build_opener(NoRedirect,
+                                                  urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.turn = 0
+
+    def request(self, path, data=None, headers=None):
+        """Returns (status, seconds to first byte); the body is always read to the end."""
+        req = urllib.request.Request(self.base + path, data=data,
+                                     headers={"X-Forwarded-For": self.address, **(headers or {})})
+        t0 = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=120) as response:
+                response.read(1)
+                ttfb = time.perf_counter() - t0
+                response.read()
+                return response.status, ttfb
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, time.perf_counter() - t0
+
+    def form(self, path, **fields):
+        return self.request(path, urllib.parse.urlencode(fields).encode())
+
+    def chat(self, stream):
+        self.turn += 1
+        # a few shared openers so the cache and single-flight layers see realistic repeats
+        message = random.choice(["Merhaba", "what can you do?"]) if self.turn == 1 else f"soru {self.turn} {self.email}"
+        payload = json.dumps({"message": message, "stream": stream}).encode()
+        headers = {"Content-Type": "application/json"}
+        if stream:
+            headers["Accept"] = "text/event-stream"
+        return self.request("/chat", payload, headers)
+
+    def run(self, route):
+        if route == "root":
+            return self.request("/")
+        if route == "history":
+            return self.request("/history?limit=50")
+        if route == "chat":
+            return self.chat(False)
+        if route == "chat_stream":
+            return self.chat(True)
+        if route == "login":
+            return self.form("/login", email=self.email, password="loadtest")
+        if route == "register":
+            newcomer = VirtualUser(self.base, random.getrandbits(32))
+            return newcomer.form("/register", username=newcomer.username, email=newcomer.email, password="loadtest")
+        raise ValueError(route)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base + "/login", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not come up")
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(samples, duration):
+    routes = {}
+    for route in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == route]
+        latencies = sorted(s[2] * 1000 for s in rows)
+        ttfb = sorted(s[3] * 1000 for s in rows)
+        routes[route] = {
+            "count": len(rows),
+            "errors": sum(1 for s in rows if s[1] >= 400),
+            "rps": round(len(rows) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "ttfb_p50_ms": round(percentile(ttfb, 50), 2),
+        }
+    return routes
+
+
+def print_table(result, previous=None):
+    print(f"commit={result['commit']} total_rps={result['total_rps']} errors={result['errors']}")
+    print(f"{'route':12s} {'count':>7s} {'err':>5s} {'rps':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'ttfb50':>9s}")
+    for route, r in result["routes"].items():
+        line = (f"{route:12s} {r['count']:7d} {r['errors']:5d} {r['rps']:8.2f} {r['p50_ms']:9.1f} "
+                f"{r['p95_ms']:9.1f} {r['p99_ms']:9.1f} {r['ttfb_p50_ms']:9.1f}")
+        old = (previous or {}).get("routes", {}).get(route)
+        if old:
+            line += f"   vs {previous['commit']}: rps {r['rps'] - old['rps']:+.2f} p99 {r['p99_ms'] - old['p99_ms']:+.1f}ms"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="route=weight,...")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn --threads (gthread)")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake upstream time to first token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of primary-model calls the stub stalls")
+    parser.add_argument("--stall-seconds", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of primary-model calls answered 503")
+    parser.add_argument("--hedge", choices=("0", "1"), default="1", help="SYRIXRM_HEDGE for the app")
+    parser.add_argument("--fallback-model", default="", help="SYRIXRM_FALLBACK_MODEL; the stub never faults it")
+    parser.add_argument("--state", default="memory://",
+                        help="SYRIXRM_STATE_URL; shm:// for one file per node, fake-redis for bench/fake_redis.py")
+    parser.add_argument("--server-sessions", action="store_true", help="SYRIXRM_SERVER_SESSIONS=1")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"))
+    parser.add_argument("--compare", help="earlier result JSON to diff against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    mix = {}
+    for part in args.mix.split(","):
+        route, weight = part.split("=")
+        mix[route.strip()] = float(weight)
+
+    stub = fake_openai.serve(config=fake_openai.FakeConfig(
+        args.latency, args.tokens_per_sec, args.reply_tokens, args.stall_rate, args.stall_seconds,
+        args.error_rate, fault_models=["gpt-4o-mini"]))
+    state_url = args.state
+    redis_stub = None
+    if state_url == "fake-redis":
+        redis_stub = fake_redis.serve()
+        state_url = f"redis://127.0.0.1:{redis_stub.server_port}/0"
+    workdir = tempfile.mkdtemp(prefix="syrixrm-load-")
+    if state_url.startswith("shm:"):
+        # a fresh file per run instead of the node-wide /dev/shm one (synchronous=OFF, so disk is fine)
+        state_url = "sqlite:///" + os.path.join(workdir, "state.db")
+    prom_dir = os.path.join(workdir, "prometheus")
+    os.makedirs(prom_dir)
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(os.environ,
+               OPENAI_API_KEY="loadtest",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{stub.server_port}/v1",
+               DATABASE_URL="sqlite:///" + os.path.join(workdir, "load.db"),
+               SYRIXRM_BCRYPT_ROUNDS=str(args.bcrypt_rounds),
+               # virtual users connect from 127.0.0.1 but send their own X-Forwarded-For
+               SYRIXRM_PROXY_HOPS="1",
+               # they also chat far faster than people, so per-minute budgets would only measure 429s
+               SYRIXRM_USER_RPM="0", SYRIXRM_USER_TPM="0", SYRIXRM_GUEST_RPM="0", SYRIXRM_GUEST_TPM="0",
+               SYRIXRM_HEDGE=args.hedge, SYRIXRM_FALLBACK_MODEL=args.fallback_model,
+               SYRIXRM_STATE_URL=state_url, SYRIXRM_SERVER_SESSIONS="1" if args.server_sessions else "0",
+               PROMETHEUS_MULTIPROC_DIR=prom_dir)
+    env.pop("SYRIXRM_FAKE_LLM", None)
+    target = "asgi:application" if "uvicorn" in args.worker_class.lower() else "app:app"
+    cmd = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-k", args.worker_class,
+           "--threads", str(args.threads), "-b", f"127.0.0.1:{port}", "--timeout", "120", target]
+    log = open(os.path.join(workdir, "gunicorn.log"), "w")
+    # schema is created once up front; workers never touch it at boot
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "migrate"], cwd=ROOT, env=env,
+                   stdout=log, stderr=subprocess.STDOUT, check=True)
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_up(base)
+        users = [VirtualUser(base, i) for i in range(args.users)]
+        for user in users:
+            user.form("/register", username=user.username, email=user.email, password="loadtest")
+            user.form("/login", email=user.email, password="loadtest")
+
+        samples = []
+        lock = threading.Lock()
+        routes, weights = list(mix), list(mix.values())
+        stop = time.monotonic() + args.duration
+
+        def drive(user):
+            rng = random.Random(user.email)
+            while time.monotonic() < stop:
+                route = rng.choices(routes, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    status, ttfb = user.run(route)
+                except OSError:
+                    status, ttfb = 599, time.perf_counter() - t0
+                with lock:
+                    samples.append((route, status, time.perf_counter() - t0, ttfb))
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=drive, args=(user,), daemon=True) for user in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+        with open(os.path.join(workdir, "metrics.txt"), "wb") as f:
+            f.write(urllib.request.urlopen(base + "/metrics").read())
+        print(f"server-side metrics: {os.path.join(workdir, 'metrics.txt')}")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        stub.shutdown()
+        if redis_stub:
+            redis_stub.shutdown()
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "total_rps": round(len(samples) / elapsed, 2),
+        "errors": sum(1 for s in samples if s[1] >= 400),
+        "upstream_requests": stub.config.requests,
+        "upstream_faults": {"stalls": stub.config.stalls, "errors": stub.config.errors},
+        "routes": summarize(samples, elapsed),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_table(result, previous)
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{result['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""/history latency while a login flood keeps bcrypt busy.
+
+Serves the app from a threaded in-process server, hammers /login from
+--flood threads and samples /history from one logged-in client:
+
+    python bench/login_flood.py --flood 32 --seconds 10
+    python bench/login_flood.py --flood 32 --seconds 10 --inline   # old behaviour
+"""
+import argparse
+import http.cookiejar
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flood", type=int, default=32, help="concurrent login threads")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    parser.add_argument("--inline", action="store_true", help="hash on the request thread (no pool)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syrixrm-bench-")
+    os.environ.update({
+        "SYRIXRM_FAKE_LLM": "1",
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SYRIXRM_BCRYPT_ROUNDS": str(args.rounds),
+    })
+    if args.inline:
+        os.environ["SYRIXRM_PASSWORD_WORKERS"] = "0"
+    import app as syrix
+    with syrix.app.app_context():
+        syrix.upgrade_schema()
+
+    server = make_server("127.0.0.1", 0, syrix.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    form = urllib.parse.urlencode({"username": "bench", "email": "bench@example.com", "password": "pw"}).encode()
+    opener = urllib.request.build_opener(NoRedirect)
+    reader = urllib.request.build_opener(NoRedirect, urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    for client, path in ((opener, "/register"), (reader, "/login")):
+        try:
+            client.open(base + path, form)
+        except urllib.error.HTTPError:
+            pass  # 302 to the next page
+
+    stop = time.monotonic() + args.seconds
+    statuses = {}
+    lock = threading.Lock()
+
+    def flood():
+        while time.monotonic() < stop:
+            try:
+                status = opener.open(base + "/login", form).status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=flood, daemon=True) for _ in range(args.flood)]
+    for t in threads:
+        t.start()
+    latencies = []
+    while time.monotonic() < stop:
+        t0 = time.perf_counter()
+        reader.open(base + "/history").read()
+        latencies.append((time.perf_counter() - t0) * 1000)
+        time.sleep(0.01)
+    for t in threads:
+        t.join()
+    server.shutdown()
+
+    mode = "inline" if args.inline else f"pool({syrix.PASSWORD_WORKERS}+{syrix.PASSWORD_QUEUE})"
+    print(f"mode={mode} cost={args.rounds} flood={args.flood} logins={statuses}")
+    print(f"/history n={len(latencies)} p50={statistics.median(latencies):.1f}ms "
+          f"p95={percentile(latencies, 95):.1f}ms p99={percentile(latencies, 99):.1f}ms "
+          f"max={max(latencies):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
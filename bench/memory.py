@@ -0,0 +1,80 @@
+"""Benchmark the semantic memory index: file size, scan latency and fact recall.
+
+Fills one user's float16 vector file with --sizes records of filler text, plants
+--facts sentences at random positions and then asks about each one, using the
+deterministic hash embedder so runs are repeatable and need no API key:
+
+    python bench/memory.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+import app as syrix  # noqa: E402
+
+TOPICS = ("weather football recipe travel music code python history movie stock market garden coffee train "
+          "meeting deadline invoice laptop phone battery screen keyboard holiday hotel flight museum").split()
+FACTS = [("cat", "Pamuk"), ("dentist", "Dr. Aydın"), ("car", "a red Fiat"), ("employer", "Acme Lojistik"),
+         ("hometown", "Eskişehir"), ("favourite band", "Duman"), ("allergy", "peanuts"), ("gym", "FitLife Kadıköy"),
+         ("landlord", "Mr. Demir"), ("bank", "Ziraat"), ("sister", "Elif"), ("laptop", "a ThinkPad X1")]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--facts", type=int, default=len(FACTS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dims", type=int, default=syrix.MEMORY_DIMS)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    embedder = syrix.HashEmbedder(args.dims)
+    workdir = tempfile.mkdtemp(prefix="syrixrm-memory-")
+    print(f"{'records':>8s} {'file MB':>8s} {'embed/s':>9s} {'p50':>8s} {'p99':>8s} {'hit@1':>6s} {'hit@8':>6s}")
+    try:
+        for size in args.sizes:
+            memory = syrix.MemoryIndex(os.path.join(workdir, str(size)), embedder)
+            facts = dict(zip(rng.sample(range(1, size + 1), args.facts), FACTS[:args.facts]))
+            t0 = time.perf_counter()
+            for start in range(1, size + 1, 1000):
+                ids = list(range(start, min(size, start + 999) + 1))
+                texts = [f"My {facts[i][0]} is {facts[i][1]}." if i in facts else
+                         " ".join(rng.choice(TOPICS) for _ in range(rng.randint(5, 30))) for i in ids]
+                memory.append(1, ids, embedder.embed(texts))
+            embed_rate = size / (time.perf_counter() - t0)
+
+            timings = []
+            hits1 = hits8 = 0
+            questions = list(facts.items())
+            for n in range(args.queries):
+                message_id, (subject, _) = questions[n % len(questions)]
+                t0 = time.perf_counter()
+                found = [i for i, _ in memory.search(1, f"what is my {subject}?", 8, size + 1)]
+                timings.append((time.perf_counter() - t0) * 1000)
+                hits1 += found[:1] == [message_id]
+                hits8 += message_id in found
+            print(f"{size:8d} {os.path.getsize(memory.path(1)) / 1e6:8.1f} {embed_rate:9.0f} "
+                  f"{percentile(timings, .5):6.2f}ms {percentile(timings, .99):6.2f}ms "
+                  f"{hits1 / args.queries:6.2f} {hits8 / args.queries:6.2f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    np.seterr(all="ignore")
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark /search's FTS5 index against LIKE scans on a large message table.
+
+Fills a throwaway SQLite file with --rows messages spread over --users users,
+then times the migrate + search-backfill path and compares per-query latency:
+
+    python bench/search.py --rows 1000000 --users 200
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def fill(path, rows, users, vocabulary, rng):
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO user (id, username, email, password) VALUES (?, ?, ?, 'x')",
+                     ((i, f"user{i}", f"user{i}@example.com") for i in range(1, users + 1)))
+    # Zipf-ish word frequencies so the queries see both common and rare terms
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def messages():
+        for i in range(rows):
+            words = rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(5, 40))
+            yield (rng.randint(1, users), "assistant" if i % 2 else "user", " ".join(words), len(words))
+
+    conn.executemany("INSERT INTO message (user_id, role, content, tokens, timestamp) "
+                     "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)", messages())
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=50, help="per frequency band")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syrixrm-search-")
+    path = os.path.join(workdir, "search.db")
+    os.environ["SYRIXRM_FAKE_LLM"] = "1"
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+    import app as syrix
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"w{i:05d}" for i in range(args.vocabulary)]
+    with syrix.app.app_context():
+        syrix.db.create_all()
+        t0 = time.perf_counter()
+        fill(path, args.rows, args.users, vocabulary, rng)
+        print(f"filled {args.rows} rows for {args.users} users in {time.perf_counter() - t0:.1f}s")
+
+        t0 = time.perf_counter()
+        syrix.upgrade_schema()
+        migrate_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        indexed = syrix.backfill_search_index()
+        print(f"migrate {migrate_s * 1000:.0f}ms, backfill {indexed} rows in {time.perf_counter() - t0:.1f}s")
+
+        # the generated messages contain no digits-only words, so a user's own id must match nothing
+        for user_id in rng.sample(range(1, args.users + 1), min(20, args.users)):
+            hits = syrix.search_messages(user_id, str(user_id))
+            assert not hits, f"search for {user_id!r} matched outside content: {hits[:3]}"
+
+        # LIKE can stop early on common words but must scan everything for rare or absent ones
+        bands = {
+            "common": vocabulary[:100],
+            "mid": vocabulary[100:2000],
+            "rare": vocabulary[2000:],
+            "absent": [f"x{i:05d}" for i in range(1000)],
+        }
+
+        def like(user_id, text, scoped):
+            query = syrix.Message.query
+            if scoped:
+                query = query.filter(syrix.Message.user_id == user_id)
+            for term in text.split():
+                query = query.filter(syrix.Message.content.like(f"%{term}%"))
+            return query.order_by(syrix.Message.id.desc()).limit(syrix.SEARCH_PAGE_SIZE).all()
+
+        strategies = (
+            ("like (table scan)", lambda u, q: like(u, q, scoped=False)),
+            ("like (per user)", lambda u, q: like(u, q, scoped=True)),
+            ("fts5", lambda u, q: syrix.search_messages(u, q, syrix.SEARCH_PAGE_SIZE + 1)),
+        )
+        print(f"{'strategy':18s} {'band':7s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+        for band, terms in bands.items():
+            samples = [(rng.randint(1, args.users), rng.choice(terms)) for _ in range(args.queries)]
+            for name, run in strategies:
+                timings = []
+                for user_id, text in samples:
+                    t0 = time.perf_counter()
+                    run(user_id, text)
+                    timings.append((time.perf_counter() - t0) * 1000)
+                print(f"{name:18s} {band:7s} {percentile(timings, .5):7.2f}ms {percentile(timings, .95):7.2f}ms "
+                      f"{percentile(timings, .99):7.2f}ms")
+    print(f"database: {path} ({os.path.getsize(path) / 1e6:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+
+# app.py does no I/O at import, so workers fork from a parent that has already built the app.
+# Run `flask --app app migrate` before starting; SYRIXRM_PRELOAD=0 imports the app in each worker.
+preload_app = os.getenv("SYRIXRM_PRELOAD", "1") != "0"
+
+
+def child_exit(server, worker):
+    # drop a dead worker's live gauges from the shared Prometheus directory
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,182 @@
+// per-user values rendered into the page as a small JSON blob (see templates/chat.html)
+const pageData = JSON.parse(document.getElementById('page-data').textContent);
+const messagesEl = document.getElementById('messages');
+const inputEl = document.getElementById('user-input');
+const sendBtn = document.getElementById('send-btn');
+const typingIndicator = document.getElementById('typing-indicator');
+
+function formatTime(dt){
+  const d = new Date(dt);
+  return d.toLocaleTimeString([], {hour:'2-digit', minute:'2-digit'});
+}
+
+function appendMessage(text, role, meta=null, raw=false, prepend=false){
+  const wrapper = document.createElement('div');
+  wrapper.className = 'message ' + (role === 'user' ? 'user' : 'ai');
+
+  const avatar = document.createElement('div');
+  avatar.className = 'avatar';
+  avatar.textContent = role === 'user' ? (pageData.username ? String(pageData.username).slice(0,2).toUpperCase() : 'U') : 'AI';
+
+  const bubbleWrap = document.createElement('div');
+  bubbleWrap.style.display = 'flex';
+  bubbleWrap.style.flexDirection = 'column';
+
+  const bubble = document.createElement('div');
+  bubble.className = 'bubble';
+  if(raw){
+    bubble.innerHTML = text;
+  } else {
+    bubble.textContent = text;
+  }
+
+  bubbleWrap.appendChild(bubble);
+
+  if(meta){
+    const m = document.createElement('div');
+    m.className = 'meta';
+    m.textContent = meta;
+    bubbleWrap.appendChild(m);
+  }
+
+  wrapper.appendChild(avatar);
+  wrapper.appendChild(bubbleWrap);
+  if(prepend){
+    messagesEl.insertBefore(wrapper, messagesEl.firstChild);
+    return bubble;
+  }
+  messagesEl.appendChild(wrapper);
+  wrapper.scrollIntoView({behavior:'smooth', block:'end'});
+  return bubble;
+}
+
+// history is paged by id: newest page first, older pages fetched on scroll
+const HISTORY_PAGE = 50;
+let oldestId = null;
+let historyExhausted = false;
+let historyLoading = false;
+
+async function loadHistory(){
+  const res = await fetch('/history?limit=' + HISTORY_PAGE);
+  const data = await res.json();
+  if(!data || data.length === 0){ 
+    historyExhausted = true;
+    appendMessage("Merhaba! Sana nasıl yardım edebilirim?","ai", null);
+    return;
+  }
+  oldestId = data[0].id;
+  historyExhausted = data.length < HISTORY_PAGE;
+  data.forEach(m => {
+    appendMessage(m.content, m.role, m.timestamp ? formatTime(m.timestamp) : null);
+  });
+}
+
+async function loadOlder(){
+  if(historyLoading || historyExhausted || oldestId === null) return;
+  historyLoading = true;
+  try{
+    const res = await fetch('/history?limit=' + HISTORY_PAGE + '&before_id=' + oldestId);
+    const data = await res.json();
+    historyExhausted = data.length < HISTORY_PAGE;
+    if(data.length === 0) return;
+    oldestId = data[0].id;
+    // keep the viewport anchored while older messages are inserted above it
+    const prevHeight = messagesEl.scrollHeight;
+    for(let i = data.length - 1; i >= 0; i--){
+      const m = data[i];
+      appendMessage(m.content, m.role, m.timestamp ? formatTime(m.timestamp) : null, false, true);
+    }
+    messagesEl.scrollTop += messagesEl.scrollHeight - prevHeight;
+  } finally {
+    historyLoading = false;
+  }
+}
+
+messagesEl.addEventListener('scroll', ()=>{
+  if(messagesEl.scrollTop < 80) loadOlder();
+});
+function newConversation(){
+  // basitçe temizle — sunucu tarafında yeni ID vs gerekirse ileride ekle
+  messagesEl.innerHTML = '';
+  historyExhausted = true;
+  appendMessage("Yeni konuşma başlatıldı. Nasıl yardımcı olabilirim?","ai");
+}
+
+function showTyping(on=true){
+  typingIndicator.style.display = on ? 'flex' : 'none';
+}
+
+// stream real tokens from the server (SSE frames: "data: {...}\n\n")
+async function streamReply(text){
+  const res = await fetch('/chat',{
+    method:'POST',
+    headers:{'Content-Type':'application/json','Accept':'text/event-stream'},
+    body:JSON.stringify({message:text, stream:true})
+  });
+  if(!res.ok || !res.body){
+    // 429/503 carry {"error": ...} and a Retry-After header
+    const body = await res.json().catch(()=>({}));
+    throw new Error(body.error || 'Sunucu hatası');
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let bubble = null;
+  while(true){
+    const {value, done} = await reader.read();
+    if(done) break;
+    buffer += decoder.decode(value, {stream:true});
+    let idx;
+    while((idx = buffer.indexOf('\n\n')) !== -1){
+      const frame = buffer.slice(0, idx);
+      buffer = buffer.slice(idx + 2);
+      if(!frame.startsWith('data: ')) continue;
+      const evt = JSON.parse(frame.slice(6));
+      if(evt.error) throw new Error(evt.error);
+      if(evt.delta){
+        if(!bubble){
+          showTyping(false);
+          bubble = appendMessage('', 'ai', formatTime(new Date()));
+        }
+        bubble.textContent += evt.delta;
+        messagesEl.scrollTop = messagesEl.scrollHeight;
+      }
+    }
+  }
+  showTyping(false);
+}
+
+async function sendMessage(){
+  const text = inputEl.value.trim();
+  if(!text) return;
+  // append user immediately
+  appendMessage(text, 'user', formatTime(new Date()));
+  inputEl.value = '';
+  // show typing
+  showTyping(true);
+  // send to server, tokens are rendered as they arrive
+  try{
+    await streamReply(text);
+  } catch(err){
+    showTyping(false);
+    appendMessage('Üzgünüm, bir hata oluştu: ' + String(err),'ai');
+  }
+}
+
+sendBtn.addEventListener('click', sendMessage);
+inputEl.addEventListener('keydown', (e)=>{
+  if(e.key === 'Enter' && !e.shiftKey){
+    e.preventDefault();
+    sendMessage();
+  }
+});
+
+// Auto-resize textarea
+inputEl.addEventListener('input', (e)=>{
+  inputEl.style.height = 'auto';
+  inputEl.style.height = (inputEl.scrollHeight) + 'px';
+});
+
+window.addEventListener('load', ()=>{
+  loadHistory();
+});